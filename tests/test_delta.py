@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+import random
+import zipfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+import delta
+import zip_writer
+
+def _write_package(path, members, level=zip_writer.DEFAULT_LEVEL):
+    with open(path, 'wb') as f, zip_writer.ZipWriter(f) as writer:
+        for name, data in members.items():
+            writer.write(name, data, level)
+
+class DeltaTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = random.Random(1)
+        self.members = {
+            f"esp32-hub/libraries/BLE/src/file{i}.cpp": ''.join(
+                f"int value_{rng.randrange(1000)} = {rng.randrange(1000)};\n" for _ in range(400)).encode()
+            for i in range(5)
+        }
+        self.members['esp32-hub/tools/blob.bin'] = rng.randbytes(20000)
+        self.base = self.path('base.zip')
+        _write_package(self.base, self.members)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def round_trip(self, target_members, **kwargs):
+        target = self.path('target.zip')
+        _write_package(target, target_members, **kwargs)
+        size, sha256 = delta.make_delta(self.base, target, self.path('target.delta'))
+        self.assertEqual(size, os.path.getsize(self.path('target.delta')))
+        out = io.BytesIO()
+        delta.apply_delta(self.base, self.path('target.delta'), out)
+        with open(target, 'rb') as f:
+            self.assertEqual(out.getvalue(), f.read())
+        return size
+
+    def test_small_edit_gives_small_delta(self):
+        members = dict(self.members)
+        name = 'esp32-hub/libraries/BLE/src/file2.cpp'
+        members[name] = members[name].replace(b'int ', b'long ', 1)
+        size = self.round_trip(members)
+        self.assertLess(size, 2000)
+
+    def test_added_removed_and_recompressed_members(self):
+        members = dict(self.members)
+        del members['esp32-hub/libraries/BLE/src/file0.cpp']
+        members['esp32-hub/boards.txt'] = b'hub.name=ESP32 Hub\n'
+        self.round_trip(members, level=0)
+
+    def test_wrong_base_is_rejected(self):
+        target = self.path('target.zip')
+        _write_package(target, dict(self.members, extra=b'x'))
+        delta.make_delta(self.base, target, self.path('target.delta'))
+        other = self.path('other.zip')
+        _write_package(other, {'other': b'y'})
+        with self.assertRaises(delta.DeltaError):
+            delta.apply_delta(other, self.path('target.delta'), io.BytesIO())
+
+    def test_corrupt_delta_does_not_verify(self):
+        target = self.path('target.zip')
+        _write_package(target, dict(self.members, extra=b'x' * 100))
+        delta.make_delta(self.base, target, self.path('target.delta'))
+        with zipfile.ZipFile(self.path('target.delta')) as zf:
+            contents = {info.filename: zf.read(info) for info in zf.infolist()}
+        manifest = contents[delta.MANIFEST_NAME].replace(b'"file_size": 100', b'"file_size": 101')
+        self.assertNotEqual(manifest, contents[delta.MANIFEST_NAME])
+        contents[delta.MANIFEST_NAME] = manifest
+        _write_package(self.path('bad.delta'), contents)
+        with self.assertRaises(delta.DeltaError):
+            delta.apply_delta(self.base, self.path('bad.delta'), io.BytesIO())
+
+if __name__ == '__main__':
+    unittest.main()
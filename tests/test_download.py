@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import threading
+import unittest
+import http.server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+import download
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serves the server's document with an ETag, Range, If-Range and If-None-Match."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        body, etag = server.body, server.etag
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and (if_range is None or if_range == etag):
+            start = int(range_header.split('=')[1].rstrip('-'))
+        if start:
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(body) - 1}/{len(body)}")
+        else:
+            self.send_response(200)
+        data = body[start:]
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if server.cut_after is not None:
+            # Drop the connection part way through
+            self.wfile.write(data[:server.cut_after])
+            server.cut_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(data)
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.requests = []
+        self.server.cut_after = None
+        self.set_document(b'{"v": 1, "pad": "' + b'x' * 5000 + b'"}', '"1"')
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/index.json"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.tmp.name, 'index.json')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def set_document(self, body, etag):
+        self.server.body = body
+        self.server.etag = etag
+
+    def read_dest(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def test_download_verifies_checksum(self):
+        body = self.server.body
+        sha256 = download.download(self.url, self.dest, hashlib.sha256(body).hexdigest(), len(body), progress=False)
+        self.assertEqual(sha256, hashlib.sha256(body).hexdigest())
+        self.assertEqual(self.read_dest(), body)
+        with self.assertRaises(download.DownloadError):
+            download.download(self.url, self.dest, '0' * 64, progress=False)
+        self.assertFalse(os.path.exists(self.dest + '.part'))
+
+    def test_retry_resumes_with_range(self):
+        body = self.server.body
+        self.server.cut_after = 1000
+        download.download(self.url, self.dest, hashlib.sha256(body).hexdigest(), backoff=0, progress=False)
+        self.assertEqual(self.read_dest(), body)
+        self.assertEqual(self.server.requests[-1].get('Range'), 'bytes=1000-')
+        self.assertEqual(self.server.requests[-1].get('If-Range'), '"1"')
+
+    def test_resume_after_remote_change_starts_over(self):
+        self.server.cut_after = 1000
+        with self.assertRaises(download.DownloadError):
+            download.download(self.url, self.dest, retries=0, progress=False)
+        self.assertEqual(os.path.getsize(self.dest + '.part'), 1000)
+
+        new_body = b'{"v": 2, "pad": "' + b'y' * 6000 + b'"}'
+        self.set_document(new_body, '"2"')
+        download.download(self.url, self.dest, progress=False)
+        self.assertEqual(self.read_dest(), new_body)
+
+    def test_refresh_uses_conditional_get(self):
+        self.assertTrue(download.refresh(self.url, self.dest, progress=False))
+        self.assertFalse(download.refresh(self.url, self.dest, progress=False))
+        self.assertEqual(self.server.requests[-1].get('If-None-Match'), '"1"')
+
+        new_body = b'{"v": 2}'
+        self.set_document(new_body, '"2"')
+        self.assertTrue(download.refresh(self.url, self.dest, progress=False))
+        self.assertEqual(self.read_dest(), new_body)
+
+    def test_refresh_never_splices_partial_download(self):
+        self.server.cut_after = 1000
+        with self.assertRaises(download.DownloadError):
+            download.refresh(self.url, self.dest, retries=0, progress=False)
+
+        new_body = b'{"v": 2, "pad": "' + b'y' * 6000 + b'"}'
+        self.set_document(new_body, '"22"')
+        self.assertTrue(download.refresh(self.url, self.dest, progress=False))
+        self.assertEqual(json.loads(self.read_dest())['v'], 2)
+        self.assertFalse(download.refresh(self.url, self.dest, progress=False))
+        self.assertEqual(json.loads(self.read_dest())['v'], 2)
+
+    def test_offline_refresh_uses_cached_copy(self):
+        with self.assertRaises(download.DownloadError):
+            download.refresh(self.url, self.dest, offline=True)
+        download.refresh(self.url, self.dest, progress=False)
+        requests = len(self.server.requests)
+        self.assertFalse(download.refresh(self.url, self.dest, offline=True))
+        self.assertEqual(len(self.server.requests), requests)
+
+if __name__ == '__main__':
+    unittest.main()
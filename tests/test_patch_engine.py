@@ -0,0 +1,90 @@
+import os
+import sys
+import glob
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import patch_engine
+
+def _reversed(file_patch):
+    """Return the FilePatch that undoes file_patch."""
+    swap = {'+': '-', '-': '+'}
+    hunks = [patch_engine.Hunk(h.new_start, h.new_len, h.old_start, h.old_len,
+                               [(swap.get(tag, tag), text) for tag, text in h.lines])
+             for h in file_patch.hunks]
+    return patch_engine.FilePatch(file_patch.new_path, file_patch.old_path, hunks)
+
+def _apply(text, patch_text):
+    file_patch, = patch_engine.parse_patch(patch_text)
+    return patch_engine.apply_patch(text.encode(), file_patch)
+
+def _lines(*lines):
+    return ''.join(line + '\n' for line in lines)
+
+class RepoPatchesTest(unittest.TestCase):
+    """The committed patches turn the original core files into working/modified/."""
+
+    def test_patches_apply_cleanly(self):
+        patch_paths = sorted(glob.glob(os.path.join(ROOT, 'patches', '*', '*.patch')))
+        self.assertTrue(patch_paths)
+        for patch_path in patch_paths:
+            for file_patch in patch_engine.read_patch(patch_path):
+                with self.subTest(patch=os.path.basename(patch_path)):
+                    with open(os.path.join(ROOT, 'working', 'modified', file_patch.target()), 'rb') as f:
+                        modified = f.read()
+                    original = patch_engine.apply_patch(modified, _reversed(file_patch))
+                    self.assertTrue(original.ok, [h.describe() for h in original.hunks])
+
+                    result = patch_engine.apply_patch(original.data, file_patch)
+                    self.assertEqual([h.status for h in result.hunks], ['applied'] * len(file_patch.hunks))
+                    self.assertEqual(result.data, modified)
+
+                    # A regenerated patch gives the same file
+                    text = patch_engine.make_patch(original.data, modified, 'a/f', 'b/f')
+                    self.assertEqual(_apply(original.data.decode(), text).data, modified)
+
+class ApplyTest(unittest.TestCase):
+    def setUp(self):
+        self.old = _lines(*'abcdefghij')
+        self.new = self.old.replace('e\n', 'E\n')
+        self.patch = patch_engine.make_patch(self.old.encode(), self.new.encode(), 'a/f', 'b/f')
+
+    def test_offset(self):
+        result = _apply('x\ny\n' + self.old, self.patch)
+        self.assertEqual(result.hunks[0].status, 'offset')
+        self.assertEqual(result.hunks[0].offset, 2)
+        self.assertEqual(result.data, ('x\ny\n' + self.new).encode())
+
+    def test_fuzz(self):
+        result = _apply(self.old.replace('b\n', 'B\n'), self.patch)
+        self.assertEqual(result.hunks[0].status, 'fuzz')
+        self.assertEqual(result.data, self.new.replace('b\n', 'B\n').encode())
+
+    def test_failed_hunk(self):
+        result = _apply(self.old.replace('e\n', 'X\n'), self.patch)
+        self.assertFalse(result.ok)
+        self.assertIsNone(result.data)
+        self.assertEqual(result.hunks[0].describe(), 'hunk #1 FAILED at 2')
+
+    def test_missing_newline_at_end_of_file(self):
+        old, new = b'a\nb', b'a\nc'
+        text = patch_engine.make_patch(old, new, 'a/f', 'b/f')
+        self.assertIn('\\ No newline at end of file', text)
+        self.assertEqual(_apply(old.decode(), text).data, new)
+
+    def test_hunk_without_leading_context_only_matches_line_1(self):
+        # As GNU patch: the change is at the start of the file, not wherever its context matches
+        text = patch_engine.make_patch(_lines('a', 'b', 'c', 'd').encode(), _lines('A', 'b', 'c', 'd').encode(), 'a/f', 'b/f')
+        self.assertTrue(_apply(_lines('a', 'b', 'c', 'd', 'e'), text).ok)
+        self.assertFalse(_apply(_lines('x', 'a', 'b', 'c', 'd'), text).ok)
+
+    def test_hunk_without_trailing_context_only_matches_end_of_file(self):
+        text = patch_engine.make_patch(_lines('a', 'b', 'c', 'd').encode(), _lines('a', 'b', 'c', 'D').encode(), 'a/f', 'b/f')
+        result = _apply(_lines('x', 'a', 'b', 'c', 'd'), text)
+        self.assertEqual(result.data, _lines('x', 'a', 'b', 'c', 'D').encode())
+        self.assertFalse(_apply(_lines('a', 'b', 'c', 'd', 'x'), text).ok)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Benchmark the packaging tools on synthetic ESP32-core-shaped fixtures.
+
+Fixtures are generated offline from a seed: a core tree and zip shaped like
+esp32-<version>/ (cores/, libraries/, variants/, tools/ with binary blobs,
+boards.txt, platform.txt) with a configurable file count, size distribution
+and number of modified files. Each stage runs on the fixture and is timed
+over several repeats; results are written as JSON and can be compared with
+an earlier run.
+
+    python3 tools/benchmark.py --files 500 2000 --patches 20 --output bench.json
+    python3 tools/benchmark.py --files 500 2000 --compare bench.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import platform
+import datetime
+import tempfile
+import contextlib
+
+import boards_index
+import check_variants
+import create_package
+
+STAGES = ['create_patches', 'apply_patches', 'create_package', 'create_package_incremental', 'check_variants']
+WORDS = ['uint8_t', 'uint32_t', 'void', 'return', 'if', 'else', 'for', 'while', 'const', 'static',
+         'esp_err_t', 'ESP_OK', 'ble_gap', 'pin', 'buffer', 'length', 'handle', 'config', 'event',
+         'xTaskCreate', 'vTaskDelay', 'log_e', 'log_d', 'nullptr', 'size_t', '->', '=', '==', '+', '(', ')']
+CHIPS = ['esp32', 'esp32s2', 'esp32s3', 'esp32c3', 'esp32c6', 'esp32h2']
+
+def _source_text(rng, size):
+    lines = []
+    total = 0
+    while total < size:
+        indent = '    ' * rng.randint(0, 3)
+        line = indent + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 10))) + ';'
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines) + '\n'
+
+def _file_size(rng, mean_size):
+    # Log-normal, like real source trees: many small files, a few large ones
+    return max(64, int(rng.lognormvariate(0, 1.0) * mean_size / 1.65))
+
+def generate_fixture(root, files, mean_size, patches, variants, binary_ratio, seed, version):
+    """Write a synthetic core (tree and zip) plus modified copies under root; return its stats.
+
+    Layout under root: core/esp32-<version>/, core.zip, working/original and
+    working/modified (patches files), boards.txt and variants/ (the local
+    copies a release packages), and core_variants/ for check_variants.
+    """
+    rng = random.Random(seed)
+    core_root = os.path.join(root, "core", f"esp32-{version}")
+    written = {}
+
+    def write(rel_path, data):
+        path = os.path.join(core_root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        written[rel_path] = len(data)
+
+    variant_names = [f"bench_{CHIPS[i % len(CHIPS)]}_{i}" for i in range(variants)]
+    boards = ["menu.PSRAM=PSRAM\n"]
+    for name in variant_names:
+        boards.append(f"{name}.name=Bench {name}\n{name}.build.variant={name}\n"
+                      f"{name}.build.mcu={name.split('_')[1]}\n"
+                      f"{name}.menu.PSRAM.disabled=Disabled\n{name}.menu.PSRAM.enabled=Enabled\n")
+    boards_text = ''.join(boards).encode()
+    write('boards.txt', boards_text)
+    write('platform.txt', _source_text(rng, 4096).encode())
+    for name in variant_names:
+        write(f"variants/{name}/pins_arduino.h", _source_text(rng, 2048).encode())
+        write(f"variants/{name}/variant.cpp", _source_text(rng, 1024).encode())
+
+    sources = []
+    for i in range(files):
+        size = _file_size(rng, mean_size)
+        if rng.random() < binary_ratio:
+            chip = rng.choice(CHIPS)
+            write(f"tools/esp32-arduino-libs/{chip}/lib/lib{i}.a", rng.randbytes(size))
+        else:
+            directory = rng.choice(['cores/esp32', 'libraries/BLE/src', 'libraries/WiFi/src',
+                                    'libraries/Wire/src', 'libraries/SPI/src'])
+            rel_path = f"{directory}/file{i}.{'h' if i % 3 == 0 else 'cpp'}"
+            write(rel_path, _source_text(rng, size).encode())
+            sources.append(rel_path)
+
+    # Modify a few lines in the first `patches` source files
+    for rel_path in rng.sample(sources, min(patches, len(sources))):
+        with open(os.path.join(core_root, rel_path), 'r') as f:
+            lines = f.read().split('\n')
+        for i in range(0, len(lines) - 1, max(1, len(lines) // 4)):
+            lines[i] = lines[i] + ' // patched'
+        for tree, text in (('original', None), ('modified', '\n'.join(lines))):
+            path = os.path.join(root, "working", tree, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if text is None:
+                shutil.copy2(os.path.join(core_root, rel_path), path)
+            else:
+                with open(path, 'w') as f:
+                    f.write(text)
+
+    zip_path = os.path.join(root, "core.zip")
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for rel_path in sorted(written):
+            zf.write(os.path.join(core_root, rel_path), f"esp32-{version}/{rel_path}")
+
+    # Local boards.txt and variants/ as a release packages them
+    shutil.copy2(os.path.join(core_root, 'boards.txt'), os.path.join(root, 'boards.txt'))
+    os.makedirs(os.path.join(root, 'variants'))
+    for name in variant_names[:len(variant_names) // 2]:
+        shutil.copytree(os.path.join(core_root, 'variants', name), os.path.join(root, 'variants', name))
+    shutil.copytree(os.path.join(core_root, 'variants'), os.path.join(root, 'core_variants'))
+
+    return {
+        'files': len(written),
+        'bytes': sum(written.values()),
+        'zip_bytes': os.path.getsize(zip_path),
+        'patches': min(patches, len(sources)),
+        'variants': variants
+    }
+
+def _time(function, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return times
+
+def run_stages(root, version, jobs, level, repeat):
+    """Time every stage on the fixture in root; return {stage: [seconds per repeat]}."""
+    zip_path = os.path.join(root, "core.zip")
+    patches_dir = os.path.join(root, "patches", version)
+    create_package.WORKING_DIR = os.path.join(root, "working")
+    create_package.PATCH_DIR = patches_dir
+    cache_dir = os.path.join(root, "cache")
+    # Keep the extraction store and boards.txt index out of the user's cache
+    create_package.CACHE_DIR = cache_dir
+    results = {}
+    
+    def clear_memo():
+        # Patch parsing and archive hashing are part of what is measured
+        create_package._parsed_patches.clear()
+        create_package._archive_hashes.clear()
+
+    def clear_patches():
+        shutil.rmtree(patches_dir, ignore_errors=True)
+    results['create_patches'] = _time(lambda: create_package.create_patches(jobs), repeat, clear_patches)
+
+    patched = {}
+    def apply():
+        patched.update(create_package.apply_patches(zip_path, jobs, version)[0])
+    results['apply_patches'] = _time(apply, repeat, clear_memo)
+
+    package_file = os.path.join(root, create_package.package_name(version))
+    def clear_package():
+        clear_memo()
+        for path in (package_file, create_package.build_manifest_path(package_file)):
+            if os.path.exists(path):
+                os.remove(path)
+    def package(incremental):
+        if not create_package.create_package(zip_path, patched, level, incremental, jobs, version=version):
+            raise RuntimeError("create_package failed on the fixture")
+    results['create_package'] = _time(lambda: package(False), repeat, clear_package)
+    results['create_package_incremental'] = _time(lambda: package(True), repeat, clear_memo)
+
+    dest = os.path.join(root, "synced_variants")
+    def clear_variants():
+        shutil.rmtree(dest, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(dest)
+    def check():
+        board_variants = {board.id: board.get('build.variant')
+                          for board in boards_index.load(os.path.join(root, 'boards.txt'), cache_dir)}
+        check_variants.sync_variants(os.path.join(root, 'core_variants'), dest,
+                                     set(board_variants.values()), jobs=jobs)
+    results['check_variants'] = _time(check, repeat, clear_variants)
+    return results
+
+def compare(results, baseline):
+    """Print each stage's best time next to the baseline's for the same fixture size."""
+    previous = {(r['fixture']['files'], r['stage']): r['best'] for r in baseline['results']}
+    print(f"\n{'Files':>7} {'Stage':<28} {'Baseline s':>11} {'Now s':>9} {'Change':>8}")
+    for r in results:
+        old = previous.get((r['fixture']['files'], r['stage']))
+        if old is None:
+            continue
+        change = (r['best'] - old) / old * 100 if old else 0
+        print(f"{r['fixture']['files']:>7} {r['stage']:<28} {old:>11.4f} {r['best']:>9.4f} {change:>+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the packaging tools on synthetic fixtures')
+    parser.add_argument('--files', type=int, nargs='+', default=[200, 1000],
+                      help='Fixture sizes in number of core files (default: 200 1000)')
+    parser.add_argument('--mean-size', type=int, default=8192,
+                      help='Mean file size in bytes (log-normal; default: %(default)s)')
+    parser.add_argument('--patches', type=int, default=10,
+                      help='Number of modified files (default: %(default)s)')
+    parser.add_argument('--variants', type=int, default=12,
+                      help='Number of variant folders (default: %(default)s)')
+    parser.add_argument('--binary-ratio', type=float, default=0.1,
+                      help='Fraction of incompressible binary files (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                      help='Runs per stage; the best is reported (default: %(default)s)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                      help='Worker processes for the tools (default: CPU count)')
+    parser.add_argument('--level', type=int, default=6, choices=range(0, 10), metavar='0-9',
+                      help='Deflate level for create_package (default: 6)')
+    parser.add_argument('--seed', type=int, default=1, help='Fixture random seed (default: 1)')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', metavar='FILE', help='Compare with results from an earlier run')
+    parser.add_argument('--keep', action='store_true', help='Keep the fixture directories')
+    args = parser.parse_args()
+
+    version = create_package.ESP32_CORE_VERSION
+    results = []
+    for files in args.files:
+        root = tempfile.mkdtemp(prefix=f"esp32-hub-bench-{files}-")
+        try:
+            print(f"\nGenerating fixture with {files} files in {root}...")
+            fixture = generate_fixture(root, files, args.mean_size, args.patches, args.variants,
+                                       args.binary_ratio, args.seed, version)
+            print(f"  {fixture['files']} files, {fixture['bytes']} bytes, zip {fixture['zip_bytes']} bytes")
+            cwd = os.getcwd()
+            # create_package reads boards.txt and variants/ from the working directory
+            os.chdir(root)
+            try:
+                timings = run_stages(root, version, args.jobs, args.level, args.repeat)
+            finally:
+                os.chdir(cwd)
+        finally:
+            if not args.keep:
+                shutil.rmtree(root, ignore_errors=True)
+
+        for stage in STAGES:
+            results.append({'fixture': fixture, 'stage': stage, 'best': min(timings[stage]),
+                            'times': timings[stage]})
+            print(f"  {stage:<28} {min(timings[stage]):.4f}s")
+
+    report = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'keep')},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Indexed parser and query API for Arduino boards.txt files.
+
+boards.txt is parsed once into a BoardsIndex: board id -> Board, each with
+its flat properties and its menu options. load() keeps a pickled copy in
+the cache directory that is reused while the file's mtime/size (or, failing
+that, its SHA-256) is unchanged, so tools can query board metadata without
+rescanning the file.
+"""
+
+import os
+import pickle
+import hashlib
+import tempfile
+from dataclasses import dataclass, field
+
+import cache
+
+# Bump when the pickled layout changes
+FORMAT_VERSION = 1
+
+@dataclass
+class Board:
+    id: str
+    # Board properties without the board prefix, e.g. 'build.variant'
+    properties: dict = field(default_factory=dict)
+    # menu id -> option id -> {'label': ..., 'properties': {...}}, in file order
+    menus: dict = field(default_factory=dict)
+
+    @property
+    def name(self):
+        return self.properties.get('name', self.id)
+
+    def get(self, key, default=None):
+        return self.properties.get(key, default)
+
+    def default_options(self):
+        """Return {menu id: option id} for the first option of each menu."""
+        return {menu: next(iter(options)) for menu, options in self.menus.items() if options}
+
+    def resolve(self, selections=None):
+        """Return the flat properties with menu options applied.
+
+        selections maps menu id to option id; menus not listed use their
+        first option, as the Arduino IDE does.
+        """
+        chosen = self.default_options()
+        chosen.update(selections or {})
+        resolved = dict(self.properties)
+        for menu, option in chosen.items():
+            if option not in self.menus.get(menu, {}):
+                raise KeyError(f"{self.id}: unknown option {option!r} for menu {menu!r}")
+            resolved.update(self.menus[menu][option]['properties'])
+        return resolved
+
+    def tree(self, selections=None):
+        """Return the resolved properties as a nested dict ('build.variant' -> ['build']['variant'])."""
+        root = {}
+        for key, value in sorted(self.resolve(selections).items()):
+            node = root
+            parts = key.split('.')
+            for part in parts[:-1]:
+                child = node.setdefault(part, {})
+                if not isinstance(child, dict):
+                    # 'a=x' and 'a.b=y' both exist; keep the value under ''
+                    child = node[part] = {'': child}
+                node = child
+            if isinstance(node.get(parts[-1]), dict):
+                node[parts[-1]][''] = value
+            else:
+                node[parts[-1]] = value
+        return root
+
+@dataclass
+class BoardsIndex:
+    # menu id -> label, from the global 'menu.X=Label' lines
+    menus: dict = field(default_factory=dict)
+    boards: dict = field(default_factory=dict)
+
+    def __getitem__(self, board_id):
+        return self.boards[board_id]
+
+    def __contains__(self, board_id):
+        return board_id in self.boards
+
+    def __iter__(self):
+        return iter(self.boards.values())
+
+    def __len__(self):
+        return len(self.boards)
+
+    def names(self):
+        """Return {board id: display name}."""
+        return {board.id: board.name for board in self.boards.values()}
+
+def parse(text):
+    """Parse boards.txt content into a BoardsIndex."""
+    index = BoardsIndex()
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        prefix, _, rest = key.partition('.')
+        if not rest:
+            continue
+        if prefix == 'menu':
+            index.menus[rest] = value
+            continue
+
+        board = index.boards.get(prefix)
+        if board is None:
+            board = index.boards[prefix] = Board(prefix)
+        if rest.startswith('menu.'):
+            parts = rest.split('.', 3)
+            if len(parts) < 3:
+                continue
+            option = board.menus.setdefault(parts[1], {}).setdefault(parts[2], {'label': parts[2], 'properties': {}})
+            if len(parts) == 3:
+                option['label'] = value
+            else:
+                option['properties'][parts[3]] = value
+        else:
+            board.properties[rest] = value
+    return index
+
+def _cache_file(boards_file, cache_dir):
+    name = hashlib.sha1(os.path.abspath(boards_file).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "boards", f"{name}.pickle")
+
+def load(boards_file, cache_dir=cache.DEFAULT_CACHE_DIR):
+    """Return the BoardsIndex for boards_file, from the pickle cache when still valid."""
+    st = os.stat(boards_file)
+    cache_file = _cache_file(boards_file, cache_dir)
+    cached = None
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('version') != FORMAT_VERSION:
+            cached = None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+        cached = None
+
+    if cached and cached['mtime_ns'] == st.st_mtime_ns and cached['size'] == st.st_size:
+        return cached['index']
+
+    with open(boards_file, 'rb') as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    if cached and cached['sha256'] == sha256:
+        # Touched but not changed
+        index = cached['index']
+    else:
+        index = parse(data.decode('utf-8', 'replace'))
+
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump({
+                'version': FORMAT_VERSION,
+                'mtime_ns': st.st_mtime_ns,
+                'size': st.st_size,
+                'sha256': sha256,
+                'index': index
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_file)
+    except OSError as e:
+        # The cache is only an optimisation
+        print(f"Warning: could not cache parsed {boards_file}: {e}")
+    return index
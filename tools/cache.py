@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Content-addressed on-disk cache for downloaded archives.
+
+Objects are stored under ``objects/<sha[:2]>/<sha256>`` and looked up through a
+small JSON index that maps a key (e.g. ``esp32-core-3.0.7``) to the object's
+SHA-256, size and last use time. When the cache grows past its size limit the
+least recently used objects are evicted.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "ESP32_HUB_CACHE",
+    os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "esp32-hub")
+)
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+INDEX_NAME = "index.json"
+
+_index_lock = threading.Lock()
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    """Return the hex SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def object_path(cache_dir, sha256):
+    """Return the path of the object with the given SHA-256."""
+    return os.path.join(cache_dir, "objects", sha256[:2], sha256)
+
+def _load_index(cache_dir):
+    index_path = os.path.join(cache_dir, INDEX_NAME)
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # A damaged index only costs us a re-download
+        return {}
+
+def _save_index(cache_dir, index):
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=".index-")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(temp_path, os.path.join(cache_dir, INDEX_NAME))
+
+def lookup(cache_dir, key, expected_sha256=None, verify=True):
+    """Return the cached path for key, or None if missing or corrupt."""
+    with _index_lock:
+        index = _load_index(cache_dir)
+        entry = index.get(key)
+        if not entry:
+            return None
+        if expected_sha256 and entry['sha256'] != expected_sha256.lower():
+            return None
+        path = object_path(cache_dir, entry['sha256'])
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            del index[key]
+            _save_index(cache_dir, index)
+            return None
+
+    # Hash without the lock so concurrent lookups of large objects overlap
+    corrupt = verify and sha256_file(path) != entry['sha256']
+
+    with _index_lock:
+        index = _load_index(cache_dir)
+        current = index.get(key)
+        if not current or current['sha256'] != entry['sha256']:
+            # Replaced or dropped meanwhile; the caller can look it up again
+            return None
+        if corrupt:
+            print(f"[WARNING] Cached object for {key} is corrupt, discarding")
+            if os.path.exists(path):
+                os.remove(path)
+            del index[key]
+            _save_index(cache_dir, index)
+            return None
+        current['last_used'] = time.time()
+        _save_index(cache_dir, index)
+        return path
+
+def store(cache_dir, key, src_path, sha256=None, max_bytes=DEFAULT_MAX_BYTES):
+    """Move src_path into the cache under key and return its cached path."""
+    if sha256 is None:
+        sha256 = sha256_file(src_path)
+    path = object_path(cache_dir, sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(src_path, path)
+
+    with _index_lock:
+        index = _load_index(cache_dir)
+        index[key] = {
+            'sha256': sha256,
+            'size': os.path.getsize(path),
+            'last_used': time.time()
+        }
+        _evict(cache_dir, index, max_bytes, keep={sha256})
+        _save_index(cache_dir, index)
+    return path
+
+def _evict(cache_dir, index, max_bytes, keep=()):
+    # Several keys may share one object, so account per object
+    objects = {}
+    for key, entry in index.items():
+        obj = objects.setdefault(entry['sha256'], {'size': entry['size'], 'last_used': 0, 'keys': []})
+        obj['last_used'] = max(obj['last_used'], entry['last_used'])
+        obj['keys'].append(key)
+
+    total = sum(obj['size'] for obj in objects.values())
+    for sha256, obj in sorted(objects.items(), key=lambda item: item[1]['last_used']):
+        if total <= max_bytes:
+            break
+        if sha256 in keep:
+            continue
+        try:
+            os.remove(object_path(cache_dir, sha256))
+        except FileNotFoundError:
+            pass
+        for key in obj['keys']:
+            del index[key]
+        total -= obj['size']
+        print(f"Evicted {', '.join(obj['keys'])} from cache ({obj['size']} bytes)")
+
+def evict(cache_dir, max_bytes):
+    """Evict least recently used objects until the cache fits in max_bytes."""
+    with _index_lock:
+        index = _load_index(cache_dir)
+        _evict(cache_dir, index, max_bytes)
+        _save_index(cache_dir, index)
@@ -1,29 +1,31 @@
 #!/usr/bin/env python3
 
 import os
-import re
-import shutil
 import argparse
 import json
 
+import concurrent.futures
+
+import cache
+import boards_index
+import fileops
+import package_index
+
 DEFAULT_ESP32_VARIANTS = os.path.expanduser("~/Library/Arduino15/packages/esp32/hardware/esp32/3.0.7/variants")
 
 def get_board_names_and_titles(boards_file):
     """Extract board identifiers and their display names from boards.txt."""
-    boards = {}
-    
-    with open(boards_file, 'r') as f:
-        for line in f:
-            # Look for lines like "esp32c2.name=ESP32C2 Dev Module"
-            match = re.match(r'^([^.]+)\.name=(.+)$', line.strip())
-            if match:
-                board_id = match.group(1)
-                board_name = match.group(2)
-                # Skip esp32_family as it's a generic placeholder
-                if board_id != 'esp32_family':
-                    boards[board_id] = board_name
+    index = boards_index.load(boards_file)
     
-    return boards
+    # Skip esp32_family as it's a generic placeholder
+    return {board_id: name for board_id, name in index.names().items()
+            if board_id != 'esp32_family' and 'name' in index[board_id].properties}
+
+def get_board_variants(boards_file):
+    """Map each board to the variant folder its build.variant names."""
+    index = boards_index.load(boards_file)
+    return {board.id: board.get('build.variant') for board in index
+            if board.id != 'esp32_family' and board.get('build.variant')}
 
 def get_variant_folders(variants_dir):
     """Get list of variant folders."""
@@ -33,8 +35,34 @@ def get_variant_folders(variants_dir):
     return {name for name in os.listdir(variants_dir) 
             if os.path.isdir(os.path.join(variants_dir, name))}
 
-def sync_variants(source_variants, dest_variants, missing_variants):
-    """Copy missing variant folders from ESP32 core."""
+def _list_files(root):
+    files = []
+    for dirpath, _, names in os.walk(root):
+        files.extend(os.path.join(dirpath, name) for name in sorted(names))
+    return files
+
+def _hash_files(paths, jobs):
+    # hashlib releases the GIL, so threads hash files in parallel
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return dict(zip(paths, executor.map(cache.sha256_file, paths)))
+
+def _link_or_clone(first, dest_file, hardlink):
+    try:
+        os.link(first, dest_file)
+        return 'dedup'
+    except OSError:
+        return fileops.clone_file(first, dest_file, hardlink)
+
+def sync_variants(source_variants, dest_variants, missing_variants, hardlink=False, jobs=None):
+    """Copy missing variant folders from ESP32 core, each one once.
+    
+    Files are hashed first and identical content is stored once: the first
+    copy is reflinked from the core where the filesystem supports it,
+    hardlinked if hardlink is set (edits then show up in the ESP32 core too)
+    or copied, and every other file with the same content, including files
+    already in dest_variants, becomes a hardlink to it. Copies run on a
+    thread pool.
+    """
     synced = []
     not_found = []
     
@@ -43,51 +71,104 @@ def sync_variants(source_variants, dest_variants, missing_variants):
         return synced, not_found
     
     print("\nSyncing variants from ESP32 core...")
-    for variant in missing_variants:
+    plan = []
+    for variant in sorted(set(missing_variants)):
         source_path = os.path.join(source_variants, variant)
+        if not os.path.exists(source_path):
+            not_found.append(variant)
+            continue
         dest_path = os.path.join(dest_variants, variant)
-        
-        if os.path.exists(source_path):
-            try:
-                shutil.copytree(source_path, dest_path)
-                synced.append(variant)
-                print(f"  + Copied {variant}")
-            except Exception as e:
-                print(f"  ! Error copying {variant}: {e}")
+        for source_file in _list_files(source_path):
+            plan.append((variant, source_file, os.path.join(dest_path, os.path.relpath(source_file, source_path))))
+    
+    jobs = jobs or os.cpu_count() or 1
+    existing = _list_files(dest_variants)
+    hashes = _hash_files([source_file for _, source_file, _ in plan] + existing, jobs)
+    first_copy = {}
+    for path in existing:
+        first_copy.setdefault(hashes[path], path)
+    
+    copies = []
+    links = []
+    for variant, source_file, dest_file in plan:
+        sha256 = hashes[source_file]
+        if sha256 in first_copy:
+            links.append((variant, first_copy[sha256], dest_file))
         else:
-            not_found.append(variant)
+            first_copy[sha256] = dest_file
+            copies.append((variant, source_file, dest_file))
+    
+    for _, _, dest_file in plan:
+        os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+    
+    counts = {}
+    failed = set()
+    def run(tasks, copy):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(fileops.clone_file if copy else _link_or_clone, src, dst, hardlink): variant
+                       for variant, src, dst in tasks}
+            for future in concurrent.futures.as_completed(futures):
+                variant = futures[future]
+                try:
+                    method = future.result()
+                    counts.setdefault(variant, {}).setdefault(method, 0)
+                    counts[variant][method] += 1
+                except Exception as e:
+                    print(f"  ! Error copying {variant}: {e}")
+                    failed.add(variant)
+    
+    # Duplicates link to first copies, so those must exist first
+    run(copies, True)
+    run(links, False)
+    
+    for variant in sorted({variant for variant, _, _ in plan} - failed):
+        methods = ', '.join(f"{count} {method}" for method, count in sorted(counts.get(variant, {}).items()))
+        print(f"  + Copied {variant} ({methods})")
+        synced.append(variant)
     
     return synced, not_found
 
-def generate_boards_json(boards, variant_folders):
+def dedupe_variants(variants_dir, jobs=None):
+    """Hardlink byte-identical files under variants_dir together; return bytes saved."""
+    paths = _list_files(variants_dir)
+    hashes = _hash_files(paths, jobs or os.cpu_count() or 1)
+    first_copy = {}
+    saved = 0
+    for path in paths:
+        first = first_copy.setdefault(hashes[path], path)
+        if first == path or os.path.samefile(first, path):
+            continue
+        temp_path = path + ".dedup"
+        os.link(first, temp_path)
+        os.replace(temp_path, path)
+        saved += os.path.getsize(path)
+        print(f"  = {os.path.relpath(path, variants_dir)} -> {os.path.relpath(first, variants_dir)}")
+    return saved
+
+def generate_boards_json(boards, board_variants, variant_folders):
     """Generate boards section for package index JSON."""
     board_entries = []
     
     for board_id, board_name in sorted(boards.items()):
-        if board_id in variant_folders:
+        if board_variants.get(board_id) in variant_folders:
             board_entries.append({
                 "name": board_name
             })
     
     return board_entries
 
-def update_package_index(boards_json):
+def update_package_index(boards_json, index_path):
     """Update the package index file with new boards section."""
     try:
-        with open("package_esp32hub_index.json", 'r') as f:
-            package_data = json.load(f)
-            
-        # Update boards section
-        package_data["packages"][0]["platforms"][0]["boards"] = boards_json
-        
-        with open("package_esp32hub_index.json", 'w') as f:
-            json.dump(package_data, f, indent=4)
+        with package_index.edit(index_path) as index:
+            # Update boards section
+            index.platform().boards = [board["name"] for board in boards_json]
             
-        print("\nUpdated package_esp32hub_index.json")
+        print(f"\nUpdated {os.path.basename(index_path)}")
     except Exception as e:
         print(f"\nError updating package index: {e}")
         print("\nGenerated boards JSON for manual update:")
-        print(json.dumps(boards_json, indent=4))
+        print(json.dumps(boards_json, indent=package_index.INDENT))
 
 def main():
     parser = argparse.ArgumentParser(description='Check and sync Arduino ESP32 variants')
@@ -95,6 +176,12 @@ def main():
                       help='Path to ESP32 core variants directory')
     parser.add_argument('--generate-json', action='store_true',
                       help='Generate full package index JSON')
+    parser.add_argument('--hardlink', action='store_true',
+                      help='Hardlink synced variant files when they cannot be reflinked')
+    parser.add_argument('--dedupe', action='store_true',
+                      help='Hardlink identical files already in variants/ together')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                      help='Worker threads for hashing and copying (default: CPU count)')
     args = parser.parse_args()
     
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -106,16 +193,23 @@ def main():
     # Create variants directory if it doesn't exist
     os.makedirs(variants_dir, exist_ok=True)
     
-    # Get board IDs and variant folders
+    # Get board IDs, the variants they use and variant folders
     boards = get_board_names_and_titles(boards_file)
+    board_variants = get_board_variants(boards_file)
     variant_folders = get_variant_folders(variants_dir)
     
-    # Find mismatches
-    missing_variants = set(boards.keys()) - variant_folders
-    extra_variants = variant_folders - set(boards.keys())
+    # Several boards can share one variant folder
+    required_variants = set(board_variants.values())
+    missing_variants = required_variants - variant_folders
+    extra_variants = variant_folders - required_variants
     
     # Try to sync missing variants from ESP32 core
-    synced, not_found = sync_variants(args.variants, variants_dir, missing_variants)
+    synced, not_found = sync_variants(args.variants, variants_dir, missing_variants, args.hardlink, args.jobs)
+    
+    if args.dedupe:
+        print("\nDeduplicating variant files...")
+        saved = dedupe_variants(variants_dir, args.jobs)
+        print(f"Saved {saved} bytes")
     
     # Update missing variants list after sync
     if synced:
@@ -126,38 +220,46 @@ def main():
     print("\nSupported Boards:")
     print("================")
     for board_id, board_name in sorted(boards.items()):
-        if board_id in variant_folders:
-            print(f"  + {board_name} ({board_id})")
+        if board_variants.get(board_id) in variant_folders:
+            print(f"  + {board_name} ({board_id} -> variants/{board_variants[board_id]})")
     
     # Generate boards JSON
-    boards_json = generate_boards_json(boards, variant_folders)
+    boards_json = generate_boards_json(boards, board_variants, variant_folders)
     
     # Try to update package index or print JSON
-    update_package_index(boards_json)
+    update_package_index(boards_json, os.path.join(repo_root, 'package_esp32hub_index.json'))
     
     # Report findings
     print("\nBoards vs Variants Analysis")
     print("==========================")
-    print(f"\nFound {len(boards)} boards and {len(variant_folders)} variant folders")
+    print(f"\nFound {len(boards)} boards using {len(required_variants)} variants, "
+          f"and {len(variant_folders)} variant folders")
     
     if synced:
         print(f"\nSynced {len(synced)} variants from ESP32 core:")
         for variant in sorted(synced):
             print(f"  + {variant}")
     
+    boards_without_variant = sorted(board_id for board_id in boards if board_id not in board_variants)
+    if boards_without_variant:
+        print("\nBoards without build.variant:")
+        for board in boards_without_variant:
+            print(f"  - {board}")
+    
     if missing_variants:
-        print("\nBoards still missing variant folders:")
-        for board in sorted(missing_variants):
-            status = "(not found in ESP32 core)" if board in not_found else ""
-            print(f"  - {board} {status}")
+        print("\nVariants still missing (needed by boards):")
+        for variant in sorted(missing_variants):
+            users = ', '.join(sorted(b for b, v in board_variants.items() if v == variant))
+            status = "(not found in ESP32 core)" if variant in not_found else ""
+            print(f"  - {variant} [{users}] {status}")
     
     if extra_variants:
-        print("\nVariant folders without corresponding boards:")
+        print("\nVariant folders not used by any board:")
         for variant in sorted(extra_variants):
             print(f"  - {variant}")
             
-    if not missing_variants and not extra_variants:
+    if not missing_variants and not extra_variants and not boards_without_variant:
         print("\nAll boards have matching variant folders!")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
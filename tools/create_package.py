@@ -3,92 +3,302 @@
 import os
 import sys
 import shutil
-import tempfile
-import urllib.request
 import zipfile
 import hashlib
+import zlib
 import json
 import datetime
+import time
+import re
 import fnmatch
-import subprocess
+import argparse
+import threading
+import multiprocessing
+import concurrent.futures
+
+import cache
+import delta
+import boards_index
+import download
+import fileops
+import instrument
+import patch_engine
+import zip_writer
+import update_tools
+import watcher
+import package_index
 
 ESP32_CORE_VERSION = "3.0.7"
 ESP32_CORE_URL = f"https://github.com/espressif/arduino-esp32/releases/download/{ESP32_CORE_VERSION}/esp32-{ESP32_CORE_VERSION}.zip"
 PATCH_DIR = f"../patches/{ESP32_CORE_VERSION}"
-PACKAGE_NAME = f"esp32-hub-{ESP32_CORE_VERSION}.zip"
 PACKAGE_INDEX = "../package_esp32hub_index.json"
 WORKING_DIR = "../working"
 
-def download_core():
-    """Download the ESP32 Arduino core."""
-    print(f"Downloading ESP32 core version {ESP32_CORE_VERSION}...")
-    temp_dir = tempfile.mkdtemp()
-    zip_path = os.path.join(temp_dir, "esp32-core.zip")
+# Files and directories left out of the package
+EXCLUDE_PATTERNS = [
+    '.*',           # All hidden files/dirs
+    'tests',        
+    '__pycache__',  
+    '*.pyc',        
+    '.gitignore',
+    '.gitmodules',
+    '.pre-commit-config.yaml',
+    '.prettierignore',
+    '.readthedocs.yaml',
+    '.vale.ini',
+    '.flake8',
+    '.editorconfig',
+    '.codespellrc',
+    '.clang-format'
+]
+# Chip targets of the core; content named for one only matters to boards built for it
+KNOWN_CHIPS = ['esp32', 'esp32s2', 'esp32s3', 'esp32c2', 'esp32c3', 'esp32c5', 'esp32c6', 'esp32h2', 'esp32p4']
+# Directories holding one entry per chip: <dir>/<chip>.<ext>, <dir>/<chip>-*.<ext> or <dir>/<chip>/
+CHIP_DIRS = ['tools/ide-debug', 'tools/ide-debug/svd']
+# Files only used when the core is built as an ESP-IDF component, never by the Arduino IDE
+IDF_ONLY_PATTERNS = ['CMakeLists.txt', 'idf_component.yml', 'Kconfig.projbuild', 'component.mk']
+# Set to pin the expected SHA-256 of the core archive; cached copies must match it
+ESP32_CORE_SHA256 = None
+PACKAGE_ROOT = "esp32-hub"
+# Uncompressed bytes handed to a compression worker at a time
+COMPRESS_BATCH_BYTES = 4 * 1024 * 1024
+# Below this many bytes of patch targets, starting worker processes costs more than it saves
+PARALLEL_PATCH_BYTES = 2 * 1024 * 1024
+CACHE_DIR = cache.DEFAULT_CACHE_DIR
+CACHE_MAX_BYTES = cache.DEFAULT_MAX_BYTES
+
+def process_pool(max_workers):
+    """Return a ProcessPoolExecutor that forks no workers while other threads run."""
+    context = None
+    # A child forked from a matrix build thread could inherit locks other threads hold
+    if threading.active_count() > 1:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+def core_prefix(version=ESP32_CORE_VERSION):
+    """Return the top-level directory of the core archive for version."""
+    return f"esp32-{version}/"
+
+def package_name(version=ESP32_CORE_VERSION):
+    """Return the package ZIP file name for a core version."""
+    return f"esp32-hub-{version}.zip"
+
+def patch_dir(version=ESP32_CORE_VERSION):
+    """Return the patches/<version> directory."""
+    return os.path.join(os.path.dirname(PATCH_DIR), version)
+
+def core_url(mirror=None, version=ESP32_CORE_VERSION):
+    """Return the core archive URL, optionally from a mirror (e.g. file:///srv/esp32)."""
+    if not mirror:
+        return ESP32_CORE_URL.replace(ESP32_CORE_VERSION, version)
+    if mirror.endswith('.zip'):
+        return mirror
+    return f"{mirror.rstrip('/')}/esp32-{version}.zip"
+
+def download_core(offline=False, mirror=None, version=ESP32_CORE_VERSION, expected_sha256=None, expected_size=None):
+    """Return the path of the ESP32 Arduino core archive, downloading it if not cached."""
+    key = f"esp32-core-{version}"
+    if expected_sha256 is None and version == ESP32_CORE_VERSION:
+        expected_sha256 = ESP32_CORE_SHA256
+    zip_path = cache.lookup(CACHE_DIR, key, expected_sha256)
+    if zip_path:
+        print(f"Using cached ESP32 core version {version}: {zip_path}")
+        return zip_path
+    
+    if offline:
+        detail = " with the expected SHA-256" if expected_sha256 else ""
+        print(f"[ERROR] ESP32 core {version} is not cached in {CACHE_DIR}{detail} (offline mode)")
+        sys.exit(1)
     
-    urllib.request.urlretrieve(ESP32_CORE_URL, zip_path)
-    return temp_dir, zip_path
+    url = core_url(mirror, version)
+    print(f"Downloading ESP32 core version {version} from {url}...")
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Fixed name so an interrupted download is resumed on the next run
+    temp_path = os.path.join(CACHE_DIR, f".download-{key}.zip")
+    try:
+        sha256 = download.download(url, temp_path, expected_sha256, expected_size)
+    except download.DownloadError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    instrument.add(bytes_written=os.path.getsize(temp_path), files=1)
+    return cache.store(CACHE_DIR, key, temp_path, sha256, CACHE_MAX_BYTES)
+
+_archive_hashes = {}
 
-def setup_working_directory():
-    """Download and setup original core files in working directory."""
+def archive_sha256(zip_path):
+    """Return the SHA-256 of an archive, hashing each file only once per process."""
+    st = os.stat(zip_path)
+    key = (os.path.abspath(zip_path), st.st_size, st.st_mtime_ns)
+    if key not in _archive_hashes:
+        _archive_hashes[key] = cache.sha256_file(zip_path)
+    return _archive_hashes[key]
+
+def tree_dir(zip_sha256, version=ESP32_CORE_VERSION):
+    """Return the extraction store directory for a core archive."""
+    return os.path.join(CACHE_DIR, "trees", f"esp32-{version}-{zip_sha256[:16]}")
+
+def _load_tree_manifest(tree):
+    try:
+        with open(tree + ".json", 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _tree_is_intact(tree, manifest):
+    # Files are hardlinked into working trees, so catch edits made through them
+    for rel_path, (size, mtime_ns) in manifest['files'].items():
+        try:
+            st = os.stat(os.path.join(tree, rel_path))
+        except OSError:
+            return False
+        if st.st_size != size or st.st_mtime_ns != mtime_ns:
+            return False
+    return True
+
+def find_core_tree(version=ESP32_CORE_VERSION):
+    """Return the extracted tree of the cached core archive for version, or None."""
+    zip_path = cache.lookup(CACHE_DIR, f"esp32-core-{version}", verify=False)
+    if not zip_path:
+        return None
+    tree = tree_dir(archive_sha256(zip_path), version)
+    manifest = _load_tree_manifest(tree)
+    return tree if manifest and _tree_is_intact(tree, manifest) else None
+
+def extract_core(zip_path, version=ESP32_CORE_VERSION):
+    """Return the extraction store directory for the core archive, extracting it if needed."""
+    sha256 = archive_sha256(zip_path)
+    tree = tree_dir(sha256, version)
+    manifest = _load_tree_manifest(tree)
+    if manifest and manifest.get('sha256') == sha256 and _tree_is_intact(tree, manifest):
+        print(f"Using extracted ESP32 core {version}: {tree}")
+        return tree
+    
+    print(f"Extracting ESP32 core {version} to {tree}...")
+    prefix = core_prefix(version)
+    temp_tree = f"{tree}.tmp-{os.getpid()}"
+    shutil.rmtree(temp_tree, ignore_errors=True)
+    files = {}
+    with instrument.span("extract core", version=version) as span, zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            # Remove the esp32-VERSION prefix from paths
+            if info.is_dir() or not info.filename.startswith(prefix):
+                continue
+            rel_path = info.filename[len(prefix):]
+            target_path = os.path.join(temp_tree, rel_path)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with zip_ref.open(info) as source, open(target_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            if (info.external_attr >> 16) & 0o111:
+                os.chmod(target_path, 0o755)
+            span.add(bytes_written=info.file_size, files=1)
+    
+    for root, _, names in os.walk(temp_tree):
+        for name in names:
+            st = os.stat(os.path.join(root, name))
+            rel_path = os.path.relpath(os.path.join(root, name), temp_tree).replace(os.sep, '/')
+            files[rel_path] = (st.st_size, st.st_mtime_ns)
+    
+    trees_dir = os.path.dirname(tree)
+    os.makedirs(trees_dir, exist_ok=True)
+    # Stores (and manifests) of this exact version only; temp trees belong to running extractions
+    store_name = re.compile(rf"esp32-{re.escape(version)}-[0-9a-f]{{16}}(\.json)?")
+    for name in os.listdir(trees_dir):
+        # release-<version> trees were left by older releases
+        if store_name.fullmatch(name) or name == f"release-{version}":
+            path = os.path.join(trees_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    os.replace(temp_tree, tree)
+    # The manifest is written last and marks the store complete
+    package_index.write_atomic(tree + ".json", json.dumps({'sha256': sha256, 'files': files}))
+    return tree
+
+def setup_working_directory(offline=False, mirror=None):
+    """Download the core and clone its extraction store into working/original."""
     original_dir = os.path.join(WORKING_DIR, "original")
     
+    print("Setting up working directory with original core files...")
+    with instrument.span("download core"):
+        zip_path = download_core(offline, mirror)
+    tree = extract_core(zip_path)
+    
     # Always remove existing directory to ensure fresh copy
     if os.path.exists(original_dir):
         print("Removing existing working directory...")
         shutil.rmtree(original_dir)
     
-    print("Setting up working directory with original core files...")
-    temp_dir, zip_path = download_core()
-    try:
-        # Create original directory
-        os.makedirs(original_dir, exist_ok=True)
-        
-        # Extract directly to original directory (not in a subdirectory)
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            for member in zip_ref.namelist():
-                # Remove the arduino-esp32-VERSION prefix from paths
-                if member.startswith(f'esp32-{ESP32_CORE_VERSION}/'):
-                    new_name = member[len(f'esp32-{ESP32_CORE_VERSION}/'):]
-                    if new_name:  # Skip the directory itself
-                        target_path = os.path.join(original_dir, new_name)
-                        
-                        # Skip if it's a directory
-                        if new_name.endswith('/'):
-                            continue
-                        
-                        # Create parent directories if they don't exist
-                        os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                        
-                        # Extract the file
-                        source = zip_ref.open(member)
-                        target = open(target_path, 'wb')
-                        with source, target:
-                            shutil.copyfileobj(source, target)
-    finally:
-        shutil.rmtree(temp_dir)
+    with instrument.span("clone tree") as span:
+        counts = fileops.clone_tree(tree, original_dir, hardlink=True)
+        span.add(files=sum(counts.values()))
+    print(f"Created {original_dir} ({', '.join(f'{n} {m}' for m, n in sorted(counts.items()))})")
+
+def read_patch_hashes(patch_path):
+    """Return the (original, modified) SHA-256 recorded in a patch header, if any."""
+    hashes = {}
+    with open(patch_path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            key, _, value = line[1:].partition(':')
+            hashes[key.strip()] = value.strip()
+    return hashes.get('Original-SHA256'), hashes.get('Modified-SHA256')
 
-def create_patches():
-    """Create patch files from modified sources."""
+def _file_date(path):
+    return datetime.datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S')
+
+def diff_file(rel_file, original_file, modified_file, original_sha, modified_sha):
+    """Return the patch text for one modified file; runs in a worker process."""
+    with open(original_file, 'rb') as f:
+        original = f.read()
+    with open(modified_file, 'rb') as f:
+        modified = f.read()
+    
+    diff = patch_engine.make_patch(original, modified,
+                                   f"original/{rel_file}", f"modified/{rel_file}",
+                                   _file_date(original_file), _file_date(modified_file))
+    header = (f"# ESP32 Hub Patch for {rel_file}\n"
+              f"# Generated: {datetime.datetime.now()}\n"
+              f"# Purpose: Fix BLE memory leaks.\n"
+              f"# Original-SHA256: {original_sha}\n"
+              f"# Modified-SHA256: {modified_sha}\n"
+              "#\n")
+    return header + diff
+
+def patch_file_name(rel_dir, file):
+    """Return the patch file name for file in rel_dir, a directory relative to working/modified/."""
+    return f"001-{rel_dir.replace(os.sep, '-')}-{file}.patch"
+
+def create_patches(jobs=None, only=None):
+    """Create patch files from modified sources; return the paths written or removed."""
     print("Creating patches from modified files...")
     original_dir = os.path.join(WORKING_DIR, "original")
     modified_dir = os.path.join(WORKING_DIR, "modified")
-    
-    # Clean up existing patches
-    if os.path.exists(PATCH_DIR):
-        print("Cleaning up existing patches...")
-        for f in os.listdir(PATCH_DIR):
-            if f.endswith('.patch'):
-                os.remove(os.path.join(PATCH_DIR, f))
+    if not os.path.exists(original_dir):
+        # Fall back to the extraction store when setup has not been run
+        original_dir = find_core_tree() or original_dir
     
     if not os.path.exists(modified_dir):
         print("No modified files found in working/modified/")
-        return
+        return []
     
     # Create patches directory if it doesn't exist
     os.makedirs(PATCH_DIR, exist_ok=True)
     
-    # Walk through modified directory recursively
-    for root, _, files in os.walk(modified_dir):
+    wanted = set()
+    diff_jobs = []
+    unchanged = 0
+    
+    if only is None:
+        # Walk through modified directory recursively
+        candidates = [(root, sorted(files)) for root, _, files in os.walk(modified_dir)]
+    else:
+        candidates = [(os.path.join(modified_dir, os.path.dirname(path)), [os.path.basename(path)])
+                      for path in sorted(only) if os.path.isfile(os.path.join(modified_dir, path))]
+    
+    for root, files in candidates:
         for file in files:
             if file.endswith(('.cpp', '.h')):
                 rel_path = os.path.relpath(root, modified_dir)
@@ -97,209 +307,855 @@ def create_patches():
                 original_file = os.path.join(original_dir, rel_path, file)
                 
                 if os.path.exists(original_file):
-                    patch_name = f"001-{rel_path.replace('/', '-')}-{file}.patch"
+                    patch_name = patch_file_name(rel_path, file)
                     patch_path = os.path.join(PATCH_DIR, patch_name)
+                    wanted.add(patch_name)
                     
-                    print(f"Processing: {rel_path}/{file}")
-                    
-                    # Create diff with correct paths
-                    temp_patch = patch_path + ".tmp"
-                    os.system(f"cd {WORKING_DIR} && diff -u original/{rel_path}/{file} modified/{rel_path}/{file} > {temp_patch}")
+                    hashes = (cache.sha256_file(original_file), cache.sha256_file(modified_file))
+                    if os.path.exists(patch_path) and read_patch_hashes(patch_path) == hashes:
+                        unchanged += 1
+                        continue
                     
-                    # Add header and copy content
-                    with open(temp_patch, 'r') as src, open(patch_path, 'w') as dst:
-                        dst.write(f"# ESP32 Hub Patch for {rel_path}/{file}\n")
-                        dst.write(f"# Generated: {datetime.datetime.now()}\n")
-                        dst.write(f"# Purpose: Fix BLE memory leaks.\n")
-                        dst.write("#\n")
-                        content = src.read()
-                        dst.write(content)
-                    
-                    # Remove temp file
-                    os.remove(temp_patch)
-                    print(f"[SUCCESS] Created patch: {patch_path}")
+                    rel_file = f"{rel_path.replace(os.sep, '/')}/{file}"
+                    diff_jobs.append((patch_path, (rel_file, original_file, modified_file) + hashes))
                 else:
                     print(f"[WARNING] Original file not found: {original_file}")
-
-def apply_patches(work_dir):
-    """Apply patches to the core."""
-    print("\n=== Patch Application ===")
-    print(f"Working directory: {os.path.basename(work_dir)}")
     
-    # Adjust work_dir to point to the esp32-3.0.7 subdirectory
-    work_dir = os.path.join(work_dir, f"esp32-{ESP32_CORE_VERSION}")
-    print(f"Adjusted work directory: {work_dir}")
+    # Clean up patches whose modified file is gone
+    if only is None:
+        scope = set(os.listdir(PATCH_DIR))
+    else:
+        scope = {patch_file_name(os.path.dirname(path) or '.', os.path.basename(path)) for path in only}
+    written = []
+    for f in sorted(scope - wanted):
+        if f.endswith('.patch') and os.path.exists(os.path.join(PATCH_DIR, f)):
+            print(f"Removing stale patch: {f}")
+            os.remove(os.path.join(PATCH_DIR, f))
+            written.append(os.path.join(PATCH_DIR, f))
     
-    if not os.path.exists(PATCH_DIR):
-        print(f"[ERROR] Patch directory not found: {PATCH_DIR}")
-        return
+    jobs = min(jobs or os.cpu_count() or 1, len(diff_jobs))
+    if jobs > 1:
+        with process_pool(jobs) as executor:
+            patches = list(executor.map(diff_file, *zip(*(args for _, args in diff_jobs))))
+    else:
+        patches = [diff_file(*args) for _, args in diff_jobs]
+    
+    for (patch_path, args), content in zip(diff_jobs, patches):
+        print(f"Processing: {args[0]}")
+        # Sources need not be UTF-8; write to a temp file so a failure never truncates the old patch
+        temp_path = patch_path + ".tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8', errors='surrogateescape') as f:
+                f.write(content)
+            os.replace(temp_path, patch_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        written.append(patch_path)
+        print(f"[SUCCESS] Created patch: {patch_path}")
+    
+    print(f"\nCreated {len(diff_jobs)} patches, {unchanged} unchanged")
+    return written
+
+def group_patches(parsed_patches):
+    """Group (patch, file_patches) pairs so patches touching the same file share a group."""
+    order = {patch: i for i, (patch, _) in enumerate(parsed_patches)}
+    groups = []
+    group_of_target = {}
+    for patch, file_patches in parsed_patches:
+        targets = {fp.target() for fp in file_patches}
+        # Merge every existing group this patch overlaps with
+        joined = []
+        for target in targets:
+            group = group_of_target.get(target)
+            if group is not None and not any(group is g for g in joined):
+                joined.append(group)
+        if joined:
+            group = joined[0]
+            for other in joined[1:]:
+                group.extend(other)
+                groups.remove(other)
+            group.append((patch, file_patches))
+            group.sort(key=lambda item: order[item[0]])
+        else:
+            group = [(patch, file_patches)]
+            groups.append(group)
+        for _, item_file_patches in group:
+            for fp in item_file_patches:
+                group_of_target[fp.target()] = group
+    return groups
+
+def apply_patch_group(group, sources):
+    """Apply one group of patches in order to {path: bytes} sources in a worker process."""
+    files = dict(sources)
+    outcomes = []
+    patched_paths = set()
+    for patch, file_patches in group:
+        messages = []
+        results = []
+        for file_patch in file_patches:
+            target = file_patch.target()
+            data = files.get(target)
+            if data is None and not file_patch.is_new:
+                messages.append(f"Target file not in core: {target}")
+                results.append(patch_engine.PatchResult(target, [patch_engine.HunkResult(1, 'failed')]))
+                continue
+            result = patch_engine.apply_patch(data, file_patch)
+            results.append(result)
+            for hunk in result.hunks:
+                if hunk.status != 'applied':
+                    messages.append(f"{target}: {hunk.describe()}")
+        
+        ok = all(result.ok for result in results)
+        if ok:
+            for result in results:
+                files[result.path] = result.data
+                patched_paths.add(result.path)
+        outcomes.append((patch, ok, messages))
+    return outcomes, {path: files[path] for path in patched_paths}
+
+_parsed_patches = {}
+_parsed_patches_lock = threading.Lock()
+
+def read_patch_cached(patch_path):
+    """Parse a patch file once per content; matrix builds share identical patches."""
+    with open(patch_path, 'rb') as f:
+        data = f.read()
+    key = hashlib.sha256(data).hexdigest()
+    with _parsed_patches_lock:
+        if key not in _parsed_patches:
+            _parsed_patches[key] = patch_engine.parse_patch(data.decode('utf-8', 'surrogateescape'))
+        return _parsed_patches[key]
+
+def prune_parsed_patches(patches_dir):
+    """Forget parsed patches whose content is no longer in patches_dir."""
+    current = set()
+    for f in os.listdir(patches_dir) if os.path.exists(patches_dir) else []:
+        if f.endswith('.patch'):
+            current.add(cache.sha256_file(os.path.join(patches_dir, f)))
+    with _parsed_patches_lock:
+        for key in set(_parsed_patches) - current:
+            del _parsed_patches[key]
+
+def apply_patches(zip_path, jobs=None, version=ESP32_CORE_VERSION, group_cache=None):
+    """Apply patches to the core; return ({path: patched bytes}, failed patches)."""
+    print(f"\n=== Patch Application ({version}) ===")
+    
+    patches_dir = patch_dir(version)
+    if not os.path.exists(patches_dir):
+        print(f"[ERROR] Patch directory not found: {patches_dir}")
+        return {}, [patches_dir]
     
-    patch_files = [f for f in os.listdir(PATCH_DIR) if f.endswith('.patch')]
+    patch_files = [f for f in os.listdir(patches_dir) if f.endswith('.patch')]
     print(f"Found {len(patch_files)} patch files to apply")
     
     successful_patches = []
     failed_patches = []
+    patched_files = {}
     
+    parsed_patches = []
     for patch in sorted(patch_files):
-        patch_path = os.path.join(PATCH_DIR, patch)
-        print(f"\nTrying: {patch}")
-        
-        # Print patch content for debugging
-        print("\nPatch content preview:")
-        with open(patch_path, 'r') as f:
-            print(''.join(f.readlines()[:10]))
-        
-        # Check if target file exists
-        target_file = os.path.join(work_dir, "libraries/BLE/src/BLE2902.cpp")
-        print(f"\nChecking target file: {target_file}")
-        print(f"File exists: {os.path.exists(target_file)}")
-        
-        # Use -p1 to strip one directory level from patch paths
-        cmd = f"patch -p1 -d {work_dir} < {patch_path} 2>&1"
-        print(f"\nRunning command: {cmd}")
-        result = os.popen(cmd).read()
-        print(f"Patch result:\n{result}")
-        
-        if "FAILED" in result or "ERROR" in result:
-            print(" [FAILED]")
-            print("-" * 40)
-            print("Error details:")
-            for line in result.split('\n'):
-                if any(x in line for x in ['FAILED', 'ERROR', 'offset', 'reject']):
-                    print(f"  {line.strip()}")
-            print("-" * 40)
+        try:
+            file_patches = read_patch_cached(os.path.join(patches_dir, patch))
+        except patch_engine.PatchError as e:
+            print(f"  {patch}: {e} [FAILED]")
             failed_patches.append(patch)
-        else:
-            print(" [OK]")
+            continue
+        if not file_patches:
             successful_patches.append(patch)
+            continue
+        parsed_patches.append((patch, file_patches))
+    
+    groups = group_patches(parsed_patches)
+    # Parsed patches are shared per content, so their identity tells unchanged groups apart
+    group_keys = [tuple((patch, id(file_patches)) for patch, file_patches in group) for group in groups]
+    cached = {}
+    if group_cache is not None:
+        cached = {i: group_cache[key] for i, key in enumerate(group_keys) if key in group_cache}
+    pending = [group for i, group in enumerate(groups) if i not in cached]
+    
+    # Read every target once, up front; workers never touch the archive
+    group_sources = []
+    prefix = core_prefix(version)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        members = set(zip_ref.namelist())
+        for group in pending:
+            sources = {}
+            for patch, file_patches in group:
+                for file_patch in file_patches:
+                    target = file_patch.target()
+                    if target not in sources and prefix + target in members:
+                        sources[target] = zip_ref.read(prefix + target)
+                        instrument.add(bytes_read=len(sources[target]))
+            group_sources.append(sources)
+    
+    jobs = jobs or os.cpu_count() or 1
+    pending_bytes = sum(len(data) for sources in group_sources for data in sources.values())
+    if jobs > 1 and len(pending) > 1 and pending_bytes >= PARALLEL_PATCH_BYTES:
+        print(f"Applying {len(pending)} patch groups with {min(jobs, len(pending))} workers")
+        with process_pool(min(jobs, len(pending))) as executor:
+            pending_results = iter(list(executor.map(apply_patch_group, pending, group_sources)))
+    else:
+        pending_results = (apply_patch_group(group, sources) for group, sources in zip(pending, group_sources))
+    group_results = [cached[i] if i in cached else next(pending_results) for i in range(len(groups))]
+    if group_cache is not None:
+        group_cache.clear()
+        group_cache.update(zip(group_keys, group_results))
+    
+    for outcomes, files in group_results:
+        patched_files.update(files)
+        instrument.add(files=len(files))
+        for patch, ok, messages in outcomes:
+            for message in messages:
+                print(f"  {patch}: {message}")
+            (successful_patches if ok else failed_patches).append(patch)
     
     # Summary report
-    print("\n=== Patch Summary ===")
+    print(f"\n=== Patch Summary ({version}) ===")
+    print(f"Patch groups: {len(groups)} ({len(cached)} unchanged)" if cached else f"Patch groups: {len(groups)}")
     print(f"Succeeded: {len(successful_patches)}")
     print(f"Failed: {len(failed_patches)}")
     
     if failed_patches:
         print("\nFailed patches:")
-        for patch in failed_patches:
+        for patch in sorted(failed_patches):
             print(f"  - {patch}")
     
-    return len(successful_patches) > 0
-
-def create_package(work_dir):
-    """Create the final package ZIP file."""
-    print("Creating package...")
-    output_file = PACKAGE_NAME
-    
-    # Files and directories to exclude
-    exclude_patterns = [
-        '.*',           # All hidden files/dirs
-        'tests',        
-        '__pycache__',  
-        '*.pyc',        
-        '.gitignore',
-        '.gitmodules',
-        '.pre-commit-config.yaml',
-        '.prettierignore',
-        '.readthedocs.yaml',
-        '.vale.ini',
-        '.flake8',
-        '.editorconfig',
-        '.codespellrc',
-        '.clang-format'
-    ]
-    
-    # Create a temporary directory for package structure
-    temp_dir = tempfile.mkdtemp()
-    package_dir = os.path.join(temp_dir, "esp32-hub")
+    return patched_files, sorted(failed_patches)
+
+def is_excluded(rel_path):
+    """Check whether any component of a core-relative path matches EXCLUDE_PATTERNS."""
+    return any(fnmatch.fnmatch(part, pattern)
+               for part in rel_path.split('/')
+               for pattern in EXCLUDE_PATTERNS)
+
+def _unix_attr(info):
+    # Archives made on Windows carry no Unix mode; give those files 0644
+    return info.external_attr if info.external_attr >> 16 else 0o100644 << 16
+
+def package_members(src, core_sha256, patched_files, prefix=None, tree=None):
+    """Return the package members as (arcname, date_time, external_attr, key, source) tuples."""
+    prefix = prefix or core_prefix()
+    members = []
+    use_boards = os.path.exists('boards.txt')
+    use_variants = os.path.exists('variants')
     
-    try:
-        # Create the package directory
-        os.makedirs(package_dir, exist_ok=True)
-        
-        # Get path to core files
-        core_dir = os.path.join(work_dir, f"esp32-{ESP32_CORE_VERSION}")
+    for info in src.infolist():
+        if info.is_dir() or not info.filename.startswith(prefix):
+            continue
+        rel_path = info.filename[len(prefix):]
+        if is_excluded(rel_path):
+            continue
+        if use_boards and rel_path == 'boards.txt':
+            continue
+        if use_variants and rel_path.startswith('variants/'):
+            continue
         
-        # First, copy everything from the core
-        for item in os.listdir(core_dir):
-            src = os.path.join(core_dir, item)
-            dst = os.path.join(package_dir, item)
-            
-            if os.path.isdir(src):
-                shutil.copytree(src, dst, ignore=shutil.ignore_patterns(*exclude_patterns))
+        arcname = f"{PACKAGE_ROOT}/{rel_path}"
+        if rel_path in patched_files:
+            data = patched_files[rel_path]
+            key = f"sha256:{hashlib.sha256(data).hexdigest()}"
+            members.append((arcname, info.date_time, _unix_attr(info), key, ('data', data)))
+        else:
+            key = f"core:{core_sha256}:{info.filename}"
+            if tree:
+                source = ('file', os.path.join(tree, rel_path), info.file_size)
             else:
-                shutil.copy2(src, dst)
-        
-        # Then, overwrite with our custom files
-        if os.path.exists('boards.txt'):
-            shutil.copy2('boards.txt', os.path.join(package_dir, 'boards.txt'))
-        
-        if os.path.exists('variants'):
-            # Remove core variants directory
-            shutil.rmtree(os.path.join(package_dir, 'variants'))
-            # Copy our variants directory
-            shutil.copytree('variants', os.path.join(package_dir, 'variants'))
-        
-        # Create the ZIP
-        with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, _, files in os.walk(package_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    zipf.write(file_path, arcname)
+                source = ('core', info.filename, info.file_size)
+            members.append((arcname, info.date_time, _unix_attr(info), key, source))
     
-    finally:
-        shutil.rmtree(temp_dir)
+    # Then add our custom files
+    local_files = ['boards.txt'] if use_boards else []
+    if use_variants:
+        for root, _, files in os.walk('variants'):
+            local_files.extend(os.path.join(root, file) for file in sorted(files))
+    for file_path in local_files:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        st = os.stat(file_path)
+        date_time = datetime.datetime.fromtimestamp(st.st_mtime).timetuple()[:6]
+        key = f"sha256:{hashlib.sha256(data).hexdigest()}"
+        arcname = f"{PACKAGE_ROOT}/{file_path.replace(os.sep, '/')}"
+        members.append((arcname, date_time, (st.st_mode & 0xFFFF) << 16, key, ('data', data)))
+    
+    return members
+
+def target_chips(boards_file='boards.txt'):
+    """Return the build.mcu chips of the boards we ship, or None without a local boards.txt."""
+    if not os.path.exists(boards_file):
+        return None
+    index = boards_index.load(boards_file, CACHE_DIR)
+    return {board.get('build.mcu') for board in index
+            if board.id != 'esp32_family' and board.get('build.mcu')}
+
+def member_chip(rel_path):
+    """Return the chip a core-relative path is specific to, or None if it is shared."""
+    directory, _, name = rel_path.rpartition('/')
+    while directory and directory not in CHIP_DIRS:
+        directory, _, name = directory.rpartition('/')
+    if not directory:
+        return None
+    match = re.match(r'(esp32[a-z0-9]*)', name)
+    return match.group(1) if match and match.group(1) in KNOWN_CHIPS else None
+
+def _size_group(rel_path):
+    parts = rel_path.split('/')
+    return '/'.join(parts[:2]) if len(parts) > 2 else parts[0]
+
+def is_slimmed(rel_path, chips):
+    """Check whether slim_members() leaves a core-relative path out for the given chips."""
+    chip = member_chip(rel_path)
+    name = rel_path.rsplit('/', 1)[-1]
+    return bool(chip and chip not in chips) or any(fnmatch.fnmatch(name, pattern) for pattern in IDF_ONLY_PATTERNS)
+
+def slim_members(members, chips):
+    """Drop members for chips no shipped board uses and ESP-IDF-only build files."""
+    sizes = {}
+    kept = []
+    for member in members:
+        rel_path = member[0][len(PACKAGE_ROOT) + 1:]
+        chip = member_chip(rel_path)
+        size = _source_size(member[4])
+        entry = sizes.setdefault((_size_group(rel_path), chip or 'shared'), [0, 0])
+        entry[0] += size
+        if is_slimmed(rel_path, chips):
+            continue
+        entry[1] += size
+        kept.append(member)
+    return kept, sizes
+
+def size_report(sizes, limit=15):
+    """Format slim_members() sizes by directory and by chip, before and after slimming."""
+    by_group = {}
+    by_chip = {}
+    for (group, chip), (before, after) in sizes.items():
+        for totals, key in ((by_group, group), (by_chip, chip)):
+            total = totals.setdefault(key, [0, 0])
+            total[0] += before
+            total[1] += after
+    
+    lines = []
+    for title, totals in (("Directory", by_group), ("Chip", by_chip)):
+        width = max([len(key) for key in totals] + [len(title)])
+        lines.append(f"{title:<{width}} {'Before':>12} {'After':>12} {'Saved':>12}")
+        rows = sorted(totals.items(), key=lambda item: -item[1][0])
+        for key, (before, after) in rows[:limit]:
+            lines.append(f"{key:<{width}} {before:>12} {after:>12} {before - after:>12}")
+        if len(rows) > limit:
+            rest = [sum(row[1][i] for row in rows[limit:]) for i in (0, 1)]
+            lines.append(f"{f'({len(rows) - limit} more)':<{width}} {rest[0]:>12} {rest[1]:>12} {rest[0] - rest[1]:>12}")
+        lines.append("")
+    before = sum(value[0] for value in sizes.values())
+    after = sum(value[1] for value in sizes.values())
+    lines.append(f"Total uncompressed: {before} -> {after} bytes ({before - after} saved)")
+    return '\n'.join(lines)
+
+def deterministic_date_time():
+    """Return the fixed member timestamp: $SOURCE_DATE_EPOCH if set, else 1980-01-01."""
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        date_time = time.gmtime(int(epoch))[:6]
+        if date_time[0] >= 1980:
+            return date_time
+    return zip_writer.DEFAULT_DATE_TIME
+
+def normalize_members(members):
+    """Make members reproducible: sorted by name, fixed timestamp and 0644/0755 modes."""
+    date_time = deterministic_date_time()
+    normalized = []
+    for arcname, _, external_attr, key, source in members:
+        mode = 0o100755 if (external_attr >> 16) & 0o111 else 0o100644
+        normalized.append((arcname, date_time, mode << 16, key, source))
+    return sorted(normalized, key=lambda member: member[0])
+
+def build_manifest_path(package_file):
+    return package_file + ".manifest.json"
+
+def load_build_manifest(package_file):
+    """Return the manifest of the previous build if it still matches package_file."""
+    path = build_manifest_path(package_file)
+    if not os.path.exists(path) or not os.path.exists(package_file):
+        return None
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    st = os.stat(package_file)
+    if manifest.get('size') != st.st_size or manifest.get('mtime_ns') != st.st_mtime_ns:
+        print("Build manifest does not match the existing package, rebuilding everything")
+        return None
+    return manifest
+
+def _source_size(source):
+    return len(source[1]) if source[0] == 'data' else source[2]
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def compress_batch(zip_path, sources, level):
+    """Return [(crc, size, payload)] for a batch of member sources; runs in a worker process."""
+    results = []
+    with zipfile.ZipFile(zip_path, 'r') as src:
+        for source in sources:
+            if source[0] == 'core':
+                data = src.read(source[1])
+            elif source[0] == 'file':
+                data = _read_file(source[1])
+            else:
+                data = source[1]
+            crc, payload = zip_writer.compress(data, level)
+            results.append((crc, len(data), payload))
+    return results
+
+def _batches(sources, batch_bytes=COMPRESS_BATCH_BYTES):
+    batch = []
+    size = 0
+    for source in sources:
+        batch.append(source)
+        size += _source_size(source)
+        if size >= batch_bytes:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+def create_package(zip_path, patched_files, level=zip_writer.DEFAULT_LEVEL, incremental=True, jobs=None,
+                   deterministic=False, version=ESP32_CORE_VERSION, payload_cache=None, tree=None,
+                   chips=None):
+    """Create the final package ZIP file, reusing unchanged members of the previous build."""
+    print(f"Creating package for {version}...")
+    output_file = package_name(version)
+    manifest = load_build_manifest(output_file) if incremental else None
+    previous_members = manifest['members'] if manifest else {}
+    new_members = {}
+    reused = 0
+    
+    with instrument.span("plan members") as span:
+        with zipfile.ZipFile(zip_path, 'r') as src:
+            members = package_members(src, archive_sha256(zip_path), patched_files, core_prefix(version), tree)
+        if deterministic:
+            members = normalize_members(members)
+        if chips:
+            members, sizes = slim_members(members, chips)
+            print(f"\nSize by directory and chip ({', '.join(sorted(chips))} shipped):")
+            print(size_report(sizes))
+        span.add(files=len(members))
+    
+    def is_reusable(arcname, key):
+        old = previous_members.get(arcname)
+        return old is not None and old['key'] == key and old['level'] == level
+    
+    # Identical files (e.g. firmware blobs shared by variants) are compressed once
+    to_compress = []
+    key_counts = {}
+    shared = {}
+    for arcname, _, _, key, source in members:
+        if not is_reusable(arcname, key):
+            key_counts[key] = key_counts.get(key, 0) + 1
+            if key_counts[key] == 1:
+                if payload_cache is not None and (key, level) in payload_cache:
+                    shared[key] = payload_cache[(key, level)]
+                else:
+                    to_compress.append(source)
+    jobs = jobs or os.cpu_count() or 1
+    executor = process_pool(jobs) if jobs > 1 and len(to_compress) > 1 else None
+    
+    temp_output = output_file + ".tmp"
+    with instrument.span("write package", compressed=len(to_compress)) as span, open(temp_output, 'wb') as raw_out:
+        # Hash and count the archive as it is written instead of reading it back
+        out = zip_writer.HashingWriter(raw_out)
+        previous = open(output_file, 'rb') if manifest else None
+        try:
+            batches = list(_batches(to_compress))
+            if executor:
+                batch_results = executor.map(compress_batch, [zip_path] * len(batches), batches, [level] * len(batches))
+            else:
+                batch_results = (compress_batch(zip_path, batch, level) for batch in batches)
+            compressed = (result for batch in batch_results for result in batch)
+            
+            writer = zip_writer.ZipWriter(out)
+            for arcname, date_time, external_attr, key, source in members:
+                if is_reusable(arcname, key):
+                    old = previous_members[arcname]
+                    payload = zip_writer.read_raw(previous, old['offset'], old['compress_size'])
+                    entry = writer.write_raw(arcname, payload, old['crc'], old['file_size'], old['method'],
+                                             date_time=date_time, external_attr=external_attr)
+                    reused += 1
+                else:
+                    if key in shared:
+                        crc, size, payload = shared[key]
+                    else:
+                        crc, size, payload = next(compressed)
+                        if key_counts[key] > 1:
+                            shared[key] = (crc, size, payload)
+                        if payload_cache is not None and key.startswith('sha256:'):
+                            payload_cache[(key, level)] = (crc, size, payload)
+                    entry = writer.write_raw(arcname, payload, crc, size, zip_writer.ZIP_DEFLATED,
+                                             date_time=date_time, external_attr=external_attr)
+                new_members[arcname] = {
+                    'key': key,
+                    'level': level,
+                    'method': entry['method'],
+                    'crc': entry['crc'],
+                    'file_size': entry['file_size'],
+                    'compress_size': entry['compress_size'],
+                    'offset': entry['offset']
+                }
+            writer.close()
+        finally:
+            if previous:
+                previous.close()
+            if executor:
+                executor.shutdown()
+        span.add(bytes_read=sum(_source_size(source) for source in to_compress),
+                 bytes_written=out.size, files=len(new_members))
     
-    print(f"\nPackage created: {output_file}")
     print("Verifying ZIP structure...")
+    with instrument.span("verify structure"):
+        ok = verify_structure(new_members)
+    if not ok:
+        os.remove(temp_output)
+        return None
+    print("ZIP structure verified successfully!")
     
-    # Verify ZIP structure
-    with zipfile.ZipFile(output_file, 'r') as zip_ref:
-        files = zip_ref.namelist()
-        root_dirs = set(f.split('/')[0] for f in files)
-        if len(root_dirs) != 1 or 'esp32-hub' not in root_dirs:
-            print("ERROR: ZIP does not have single 'esp32-hub' root directory!")
-            return None
-        
-        required_files = ['esp32-hub/boards.txt', 'esp32-hub/platform.txt']
-        required_dirs = ['esp32-hub/cores', 'esp32-hub/variants', 'esp32-hub/tools']
-        
-        for f in required_files:
-            if f not in files:
-                print(f"ERROR: Missing required file: {f}")
-                return None
+    os.replace(temp_output, output_file)
+    with open(build_manifest_path(output_file), 'w') as f:
+        json.dump({
+            'size': out.size,
+            'sha256': out.hexdigest(),
+            'mtime_ns': os.stat(output_file).st_mtime_ns,
+            'members': new_members
+        }, f, indent=2, sort_keys=True)
+    
+    print(f"Reused {reused} of {len(new_members)} compressed members from the previous build")
+    print(f"\nPackage created: {output_file}")
+    return output_file, out.size, out.hexdigest()
+
+def verify_structure(files):
+    """Check the package member names for the layout the Arduino IDE expects."""
+    root_dirs = set(f.split('/')[0] for f in files)
+    if len(root_dirs) != 1 or PACKAGE_ROOT not in root_dirs:
+        print("ERROR: ZIP does not have single 'esp32-hub' root directory!")
+        return False
+    
+    required_files = ['esp32-hub/boards.txt', 'esp32-hub/platform.txt']
+    required_dirs = ['esp32-hub/cores', 'esp32-hub/variants', 'esp32-hub/tools']
+    
+    for f in required_files:
+        if f not in files:
+            print(f"ERROR: Missing required file: {f}")
+            return False
+    
+    for d in required_dirs:
+        if not any(f.startswith(d + '/') for f in files):
+            print(f"ERROR: Missing required directory: {d}")
+            return False
+    
+    return True
+
+def check_members(package_file, names):
+    """Read and CRC-check members of package_file in a worker process."""
+    results = []
+    with zipfile.ZipFile(package_file, 'r') as zf:
+        for name in names:
+            digest = hashlib.sha256()
+            try:
+                with zf.open(name) as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+            except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                results.append((name, None, str(e)))
+                continue
+            results.append((name, digest.hexdigest(), None))
+    return results
+
+def expected_patched_members(patched_files, chips=None):
+    """Return {arcname: sha256 hex} for the patched files create_package() puts in the package."""
+    expected = {}
+    for rel_path, data in patched_files.items():
+        if is_excluded(rel_path) or (chips and is_slimmed(rel_path, chips)):
+            continue
+        # Our boards.txt and variants/ replace the core's, patched or not
+        if (rel_path == 'boards.txt' and os.path.exists('boards.txt')) or \
+                (rel_path.startswith('variants/') and os.path.exists('variants')):
+            continue
+        expected[f"{PACKAGE_ROOT}/{rel_path}"] = hashlib.sha256(data).hexdigest()
+    return expected
+
+def verify_package(package_file, patched_files, size, checksum, jobs=None, chips=None):
+    """Check a built package against its patched files and its expected size and SHA-256."""
+    print(f"\nVerifying {package_file}...")
+    errors = []
+    with instrument.span("verify package") as span:
+        try:
+            with zipfile.ZipFile(package_file, 'r') as zf:
+                infos = [info for info in zf.infolist() if not info.is_dir()]
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"[ERROR] Cannot read {package_file}: {e}")
+            return False
         
-        for d in required_dirs:
-            if not any(f.startswith(d + '/') for f in files):
-                print(f"ERROR: Missing required directory: {d}")
-                return None
+        batches = []
+        batch_size = 0
+        for info in infos:
+            if not batches or batch_size >= COMPRESS_BATCH_BYTES:
+                batches.append([])
+                batch_size = 0
+            batches[-1].append(info.filename)
+            batch_size += info.file_size
         
-        print("ZIP structure verified successfully!")
+        jobs = min(jobs or os.cpu_count() or 1, len(batches)) or 1
+        digests = {}
+        with process_pool(jobs) as executor:
+            futures = [executor.submit(check_members, package_file, batch) for batch in batches]
+            # The members are checked by the workers while this process hashes the archive
+            actual_size = os.path.getsize(package_file)
+            actual_checksum = cache.sha256_file(package_file)
+            for future in futures:
+                for name, digest, error in future.result():
+                    if error:
+                        errors.append(f"{name}: {error}")
+                    else:
+                        digests[name] = digest
+        span.add(bytes_read=actual_size + sum(info.file_size for info in infos), files=len(infos))
     
-    return output_file
+    print(f"Checked {len(infos)} members with {jobs} workers")
+    for arcname, expected in sorted(expected_patched_members(patched_files, chips).items()):
+        if arcname not in digests and not any(error.startswith(arcname + ':') for error in errors):
+            errors.append(f"{arcname}: patched file missing from the package")
+        elif arcname in digests and digests[arcname] != expected:
+            errors.append(f"{arcname}: content differs from the patched file")
+    if actual_size != size:
+        errors.append(f"Size {actual_size} does not match the package index ({size})")
+    if actual_checksum != checksum:
+        errors.append(f"SHA-256 {actual_checksum} does not match the package index ({checksum})")
+    
+    if errors:
+        print(f"[ERROR] {package_file} failed verification:")
+        for error in errors:
+            print(f"  - {error}")
+        return False
+    print(f"[SUCCESS] {package_file} verified: members, patched files, size and SHA-256")
+    return True
 
-def update_package_index(package_file):
-    """Update the package index with the new ZIP information."""
-    size = os.path.getsize(package_file)
+def update_package_index(size, checksum, index, version=ESP32_CORE_VERSION):
+    """Update the package index with the new ZIP information; False if already published."""
+    platform = index.add_platform(version)
+    print(f"Package size ({version}): {size}")
+    print(f"SHA-256: {checksum}")
+    if platform.checksum == checksum and platform.size == size:
+        print("Checksum unchanged since the last release, no upload needed")
+        return False
     
-    with open(package_file, 'rb') as f:
-        checksum = hashlib.sha256(f.read()).hexdigest()
+    platform.set_archive(size, checksum)
+    return True
+
+def release(versions, args):
+    """Update tool dependencies, build every version and save the package index once."""
+    # The index is parsed once here and written once at the end
+    index = package_index.load(PACKAGE_INDEX)
     
-    # Update package index JSON
-    with open(PACKAGE_INDEX, 'r') as f:
-        package_data = json.load(f)
+    print("\n1. Updating tools dependencies...")
+    with instrument.span("update tools") as span:
+        index_path = update_tools.fetch_esp32_package_index(args.offline)
+        span.add(bytes_read=os.path.getsize(index_path), files=1)
+        tool_index = update_tools.load_tool_index(index_path, versions)
+        tools = update_tools.find_tools_for_versions(tool_index, versions)
+        core_digests = {version: update_tools.core_archive_digest(tool_index, version) for version in versions}
+        tools_definitions = {}
+        for _, definitions in tools.values():
+            for definition in definitions:
+                tools_definitions.setdefault((definition['name'], definition['version']), definition)
+        for version in versions:
+            index.add_platform(version)
+            update_tools.update_package_index(tools[version][0], list(tools_definitions.values()), index, version)
     
-    # Update the platform info
-    platform = package_data['packages'][0]['platforms'][0]
-    platform['size'] = str(size)
-    platform['checksum'] = f"SHA-256:{checksum}"
+    # Deltas are made against the published packages, which the builds replace
+    published = {version: index.platform(version) for version in versions}
+    published = {version: (platform.checksum, platform.size, platform.data.get('url'))
+                 for version, platform in published.items()}
+    for version in versions:
+        keep_package(package_name(version), published[version][0])
     
-    # Write updated package index
-    with open(PACKAGE_INDEX, 'w') as f:
-        json.dump(package_data, f, indent=2)
+    print("\n2. Creating packages..." if len(versions) > 1 else "\n2. Creating package...")
+    builds = build_matrix(versions, args, core_digests)
+    if any(package is None for package, _, _ in builds.values()):
+        sys.exit(1)
     
-    print(f"Package size: {size}")
-    print(f"SHA-256: {checksum}")
+    with instrument.span("update index") as span:
+        for version in versions:
+            (package_file, size, checksum), patched_files, chips = builds[version]
+            changed = update_package_index(size, checksum, index, version)
+            platform = index.platform(version)
+            if not verify_package(package_file, patched_files, platform.size, platform.checksum, args.jobs, chips):
+                # Never let the next incremental build reuse payloads from a bad package
+                for path in (package_file, build_manifest_path(package_file)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                print(f"Removed {package_file} and its build manifest")
+                sys.exit(1)
+            if changed and not args.no_delta:
+                with instrument.span("delta", version=version):
+                    update_delta(platform, *published[version], package_file, args.offline)
+            elif changed:
+                # The old delta leads to the old package
+                platform.clear_delta()
+            keep_package(package_file, checksum)
+        
+        if index.save():
+            span.add(bytes_written=len(index.dumps()), files=1)
+            print(f"Updated {PACKAGE_INDEX}")
+
+def build_release(version, args, jobs, payload_cache, core_digest=(None, None)):
+    """Download, patch and package one core version."""
+    with instrument.span("build", version=version):
+        with instrument.span("download core", version=version):
+            zip_path = download_core(args.offline, args.mirror, version, *core_digest)
+        tree = extract_core(zip_path, version)
+        with instrument.span("apply patches", version=version):
+            patched_files, failed_patches = apply_patches(zip_path, jobs, version)
+        if failed_patches:
+            print(f"[ERROR] Patching {version} failed ({', '.join(failed_patches)}), not packaging it")
+            return None, patched_files, None
+        chips = None if args.no_slim else target_chips()
+        with instrument.span("create package", version=version):
+            package = create_package(zip_path, patched_files, args.level, not args.full, jobs,
+                                     args.deterministic, version, payload_cache, tree, chips)
+        return package, patched_files, chips
+
+def build_matrix(versions, args, core_digests=None):
+    """Build several core versions concurrently; return {version: build_release() result}."""
+    core_digests = core_digests or {}
+    if len(versions) == 1:
+        return {versions[0]: build_release(versions[0], args, args.jobs, None,
+                                           core_digests.get(versions[0], (None, None)))}
+    
+    jobs = max(1, (args.jobs or os.cpu_count() or 1) // len(versions))
+    payload_cache = {}
+    parent = instrument.current()
+    def build(version):
+        with instrument.within(parent):
+            return build_release(version, args, jobs, payload_cache, core_digests.get(version, (None, None)))
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(versions)) as executor:
+        futures = {version: executor.submit(build, version) for version in versions}
+        return {version: future.result() for version, future in futures.items()}
+
+def watch(args):
+    """Rebuild the patches and the package whenever sources change, until interrupted."""
+    version = ESP32_CORE_VERSION
+    modified_dir = os.path.join(WORKING_DIR, 'modified')
+    zip_path = download_core(args.offline, args.mirror, version)
+    tree = extract_core(zip_path, version)
+    chips = None if args.no_slim else target_chips()
+    group_cache = {}
+    
+    def rebuild(changed_sources, all_sources=False):
+        start = time.perf_counter()
+        try:
+            if all_sources:
+                create_patches(args.jobs)
+            elif changed_sources:
+                create_patches(args.jobs, only=changed_sources)
+            patched_files, failed_patches = apply_patches(zip_path, args.jobs, version, group_cache)
+            prune_parsed_patches(patch_dir(version))
+            result = create_package(zip_path, patched_files, args.level, True, args.jobs,
+                                    version=version, tree=tree, chips=chips)
+        except Exception as e:
+            print(f"\n[ERROR] Rebuild failed: {type(e).__name__}: {e}")
+            return
+        status = "[SUCCESS]" if result and not failed_patches else "[ERROR]"
+        print(f"\n{status} Rebuilt in {time.perf_counter() - start:.2f}s")
+    
+    rebuild(set())
+    file_watcher = watcher.open_watcher([modified_dir, 'variants'], ['boards.txt'], args.interval, args.poll)
+    print(f"\nWatching {modified_dir}, boards.txt and variants/ (Ctrl+C to stop)")
+    try:
+        while True:
+            changed = watcher.wait_for_changes(file_watcher, args.debounce)
+            sources = set()
+            all_sources = False
+            rebuild_needed = False
+            for path in changed:
+                rel_path = os.path.relpath(path, os.path.abspath(modified_dir))
+                if rel_path == os.curdir:
+                    # The whole tree is reported after an event queue overflow
+                    all_sources = True
+                elif not rel_path.startswith(os.pardir):
+                    if path.endswith(('.cpp', '.h')):
+                        sources.add(rel_path)
+                elif path == os.path.abspath('boards.txt'):
+                    rebuild_needed = True
+                    if not args.no_slim:
+                        try:
+                            chips = target_chips()
+                        except Exception as e:
+                            print(f"\n[ERROR] Could not read boards.txt: {type(e).__name__}: {e}")
+                elif not os.path.relpath(path, os.path.abspath('variants')).startswith(os.pardir):
+                    rebuild_needed = True
+            if not sources and not all_sources and not rebuild_needed:
+                continue
+            print(f"\n=== Change detected: {', '.join(sorted(os.path.relpath(p) for p in changed))} ===")
+            rebuild(sources, all_sources)
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+    finally:
+        file_watcher.close()
+
+def published_package_key(checksum):
+    return f"esp32-hub-package-{checksum}"
+
+def keep_package(package_file, checksum):
+    """Keep a copy of a package in the cache so the next release can make a delta against it."""
+    key = published_package_key(checksum)
+    if not checksum or not os.path.exists(package_file) or cache.lookup(CACHE_DIR, key, checksum, verify=False):
+        return
+    if archive_sha256(package_file) != checksum:
+        return
+    temp_path = os.path.join(CACHE_DIR, f".{key}.zip")
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fileops.clone_file(package_file, temp_path, hardlink=True)
+    cache.store(CACHE_DIR, key, temp_path, checksum, CACHE_MAX_BYTES)
+
+def fetch_published_package(checksum, size=None, url=None, offline=False):
+    """Return the cached (or downloaded) published package with checksum, or None."""
+    key = published_package_key(checksum)
+    path = cache.lookup(CACHE_DIR, key, checksum)
+    if path or not url or offline:
+        return path
+    print(f"Downloading the published package from {url}...")
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temp_path = os.path.join(CACHE_DIR, f".download-{key}.zip")
+    try:
+        download.download(url, temp_path, checksum, size)
+    except download.DownloadError as e:
+        print(f"[WARNING] Could not download the published package: {e}")
+        return None
+    instrument.add(bytes_written=os.path.getsize(temp_path), files=1)
+    return cache.store(CACHE_DIR, key, temp_path, checksum, CACHE_MAX_BYTES)
+
+def update_delta(platform, base_checksum, base_size, base_url, package_file, offline=False):
+    """Make the delta from the previously published package and record it in platform."""
+    base = fetch_published_package(base_checksum, base_size, base_url, offline) if base_checksum else None
+    if not base:
+        print(f"No previous package {base_checksum or ''} in the cache, skipping the delta")
+        platform.clear_delta()
+        return None
+    
+    manifest = load_build_manifest(package_file)
+    levels = {name: member['level'] for name, member in manifest['members'].items()} if manifest else {}
+    delta_file = f"{os.path.splitext(package_file)[0]}-from-{base_checksum[:12]}.delta"
+    size, checksum = delta.make_delta(base, package_file, delta_file, levels)
+    with open(os.devnull, 'wb') as null:
+        delta.apply_delta(base, delta_file, null)
+    instrument.add(bytes_written=size, files=1)
+    platform.set_delta(os.path.basename(delta_file), size, checksum, base_checksum)
+    print(f"Delta created: {delta_file} ({size} bytes, verified against the package)")
+    return delta_file
 
 def verify_patches():
     """Verify all patches have proper headers."""
@@ -318,66 +1174,125 @@ def verify_patches():
                 else:
                     print(f"Verified: {patch}")
 
+def verify(versions, args):
+    """Verify the built packages against freshly applied patches and the package index."""
+    index = package_index.load(PACKAGE_INDEX)
+    chips = None if args.no_slim else target_chips()
+    ok = True
+    for version in versions:
+        try:
+            platform = index.platform(version)
+        except KeyError as e:
+            print(f"[ERROR] {e}")
+            ok = False
+            continue
+        zip_path = download_core(args.offline, args.mirror, version)
+        patched_files, failed_patches = apply_patches(zip_path, args.jobs, version)
+        if failed_patches:
+            print(f"[ERROR] Patching {version} failed ({', '.join(failed_patches)})")
+            ok = False
+            continue
+        ok = verify_package(package_name(version), patched_files, platform.size, platform.checksum,
+                            args.jobs, chips) and ok
+    if not ok:
+        sys.exit(1)
+
 def main():
+    parser = argparse.ArgumentParser(description='Build the ESP32 Hub board package')
+    subparsers = parser.add_subparsers(dest='command')
+    
+    # Options shared by every command that needs the core archive
+    download_parser = argparse.ArgumentParser(add_help=False)
+    download_parser.add_argument('--offline', action='store_true',
+                                 help='Use cached downloads only; fail when the core is not cached')
+    download_parser.add_argument('--mirror', default=os.environ.get('ESP32_HUB_MIRROR'),
+                                 help='Mirror URL or archive URL for the core (e.g. file:///srv/esp32)')
+    download_parser.add_argument('--cache-dir', default=cache.DEFAULT_CACHE_DIR,
+                                 help='Download cache directory')
+    download_parser.add_argument('--cache-size', type=int, default=cache.DEFAULT_MAX_BYTES // (1024 * 1024),
+                                 help='Download cache size limit in MB')
+    
+    # Options shared by every command that builds or checks packages
+    build_parser = argparse.ArgumentParser(add_help=False, parents=[download_parser])
+    build_parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                              help='Worker processes for patching, compression and checking (default: CPU count)')
+    build_parser.add_argument('--no-slim', action='store_true',
+                              help='Keep content for chips no board in boards.txt uses (verify: the packages kept it)')
+    package_parser = argparse.ArgumentParser(add_help=False, parents=[build_parser])
+    package_parser.add_argument('--level', type=int, default=zip_writer.DEFAULT_LEVEL, choices=range(0, 10),
+                                metavar='0-9', help='Deflate compression level (default: 6)')
+    
+    subparsers.add_parser('setup', parents=[download_parser],
+                          help='Extract the original core into working/original')
+    patches_parser = subparsers.add_parser('create-patches', help='Create patches from working/modified')
+    patches_parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                                help='Worker processes for diffing (default: CPU count)')
+    patches_parser.add_argument('--cache-dir', default=cache.DEFAULT_CACHE_DIR,
+                                help='Download cache directory, used for the extracted core when working/original is missing')
+    subparsers.add_parser('verify-patches', help='Check patch headers')
+    release_parser = subparsers.add_parser('release', parents=[package_parser],
+                                           help='Build the package and update the package index')
+    release_parser.add_argument('--deterministic', action='store_true',
+                                help='Reproducible zip: sorted members, fixed timestamps ($SOURCE_DATE_EPOCH), normalized modes')
+    release_parser.add_argument('--full', action='store_true',
+                                help='Ignore the build manifest and recompress every member')
+    release_parser.add_argument('--no-delta', action='store_true',
+                                help='Do not make a delta package against the previously published package')
+    release_parser.add_argument('--trace', metavar='FILE',
+                                help='Write a Chrome trace (chrome://tracing, Perfetto) of the release stages')
+    release_parser.add_argument('--versions', nargs='+', metavar='VERSION',
+                                help=f'Core versions to build concurrently, each patched from patches/<version>/ '
+                                     f'(default: {ESP32_CORE_VERSION})')
+    verify_parser = subparsers.add_parser('verify', parents=[build_parser],
+                                          help='Check built packages against the patches and the package index')
+    verify_parser.add_argument('--versions', nargs='+', metavar='VERSION',
+                               help=f'Core versions whose packages to verify (default: {ESP32_CORE_VERSION})')
+    watch_parser = subparsers.add_parser('watch', parents=[package_parser],
+                                         help='Rebuild patches and the package when sources change')
+    watch_parser.add_argument('--debounce', type=float, default=0.3,
+                              help='Seconds without changes before rebuilding (default: %(default)s)')
+    watch_parser.add_argument('--interval', type=float, default=0.5,
+                              help='Polling interval in seconds when inotify is unavailable (default: %(default)s)')
+    watch_parser.add_argument('--poll', action='store_true', help='Poll for changes instead of using inotify')
+    args = parser.parse_args()
+    
     # Get script's directory and move up one level
     script_dir = os.path.dirname(os.path.abspath(__file__))
     repo_root = os.path.dirname(script_dir)
     
     # Update paths to be relative to repo root
-    global PATCH_DIR, PACKAGE_INDEX, WORKING_DIR
+    global PATCH_DIR, PACKAGE_INDEX, WORKING_DIR, CACHE_DIR, CACHE_MAX_BYTES
     PATCH_DIR = os.path.join(repo_root, "patches", ESP32_CORE_VERSION)
     PACKAGE_INDEX = os.path.join(repo_root, "package_esp32hub_index.json")
     WORKING_DIR = os.path.join(repo_root, "working")
+    if 'cache_dir' in args:
+        CACHE_DIR = update_tools.CACHE_DIR = args.cache_dir
+    if 'cache_size' in args:
+        CACHE_MAX_BYTES = args.cache_size * 1024 * 1024
     
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "setup":
-            setup_working_directory()
-            return
-        elif sys.argv[1] == "create-patches":
-            create_patches()
-            return
-        elif sys.argv[1] == "verify-patches":
-            verify_patches()
-            return
-        elif sys.argv[1] == "release":
-            print("=== Starting Release Process ===")
-            print("\n1. Updating tools dependencies...")
-            result = subprocess.run([sys.executable, os.path.join(os.path.dirname(__file__), "update_tools.py")], 
-                                 check=True)
-            if result.returncode != 0:
-                print("Error updating tools dependencies")
-                sys.exit(1)
-            
-            print("\n2. Creating package...")
-            temp_dir, zip_path = download_core()
-            try:
-                # Extract directly to temp_dir
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-                
-                # Use temp_dir as work_dir since files are extracted there
-                work_dir = temp_dir
-                
-                # Debug: Print directory structure before applying patches
-                print("\nDirectory structure before patches:")
-                os.system(f"ls -R {work_dir}")
-                
-                apply_patches(work_dir)
-                package_file = create_package(work_dir)
-                update_package_index(package_file)
-                
-                # Debug: Keep the temp directory for inspection
-                print(f"\nTemp directory preserved for inspection: {temp_dir}")
-                return
-                
-            except Exception as e:
-                print(f"Error: {e}")
-                print(f"\nTemp directory preserved for inspection: {temp_dir}")
-                return
-                
-            finally:
-                shutil.rmtree(temp_dir)  # Uncomment cleanup
-            return
+    if args.command == "setup":
+        setup_working_directory(args.offline, args.mirror)
+    elif args.command == "create-patches":
+        create_patches(args.jobs)
+    elif args.command == "verify-patches":
+        verify_patches()
+    elif args.command == "verify":
+        verify(args.versions or [ESP32_CORE_VERSION], args)
+    elif args.command == "watch":
+        watch(args)
+    elif args.command == "release":
+        versions = args.versions or [ESP32_CORE_VERSION]
+        print("=== Starting Release Process ===")
+        with instrument.span("release"):
+            release(versions, args)
+        
+        print("\n=== Timing Summary ===")
+        print(instrument.summary())
+        if args.trace:
+            instrument.write_chrome_trace(args.trace)
+            print(f"Trace written to {args.trace}")
+    else:
+        parser.print_help()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
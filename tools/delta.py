@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""Delta packages between two builds of the board package.
+
+A delta is a small ZIP holding delta.json and one payload per member that
+changed. Members whose compressed data is unchanged are copied from the base
+package; changed members are stored as a binary delta of their uncompressed
+content against the base member of the same name, to be recompressed with
+the recorded deflate level, or as a delta of the compressed data when that
+would not reproduce the same bytes. Headers and the central directory are
+rebuilt with zip_writer, so the result is checked byte for byte against the
+SHA-256 and size of the target package.
+
+    python3 tools/delta.py make old.zip new.zip new.delta
+    python3 tools/delta.py apply old.zip new.delta rebuilt.zip
+"""
+
+import io
+import os
+import sys
+import json
+import zipfile
+import argparse
+
+import cache
+import zip_writer
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = "delta.json"
+BLOCK_SIZE = 32
+# Levels tried when a member's compression level is not known
+LEVELS = (zip_writer.DEFAULT_LEVEL, 9, 1)
+
+class DeltaError(Exception):
+    """Raised when a delta does not apply to a base or does not verify."""
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+def diff_bytes(old, new, block_size=BLOCK_SIZE):
+    """Return a binary delta that turns old into new.
+
+    The delta is a sequence of copy (b'C', offset, length) and insert
+    (b'I', length, bytes) operations. Blocks of old are indexed by content
+    and matches are extended forward, like a minimal rsync.
+    """
+    blocks = {}
+    for offset in range(0, len(old) - block_size + 1, block_size):
+        blocks.setdefault(old[offset:offset + block_size], offset)
+
+    ops = bytearray()
+    pending = bytearray()
+    def flush():
+        if pending:
+            ops.extend(b'I' + _varint(len(pending)) + pending)
+            pending.clear()
+
+    i = 0
+    while i < len(new):
+        offset = blocks.get(new[i:i + block_size]) if i + block_size <= len(new) else None
+        if offset is None:
+            pending.append(new[i])
+            i += 1
+            continue
+        length = block_size
+        while i + length < len(new) and offset + length < len(old) and new[i + length] == old[offset + length]:
+            length += 1
+        flush()
+        ops.extend(b'C' + _varint(offset) + _varint(length))
+        i += length
+    flush()
+    return bytes(ops)
+
+def patch_bytes(old, delta):
+    """Apply a diff_bytes() delta to old and return the new bytes."""
+    out = bytearray()
+    pos = 0
+    while pos < len(delta):
+        op = delta[pos:pos + 1]
+        if op == b'C':
+            offset, pos = _read_varint(delta, pos + 1)
+            length, pos = _read_varint(delta, pos)
+            if offset + length > len(old):
+                raise DeltaError("Copy outside the base member")
+            out += old[offset:offset + length]
+        elif op == b'I':
+            length, pos = _read_varint(delta, pos + 1)
+            out += delta[pos:pos + length]
+            pos += length
+        else:
+            raise DeltaError(f"Unknown delta operation {op!r}")
+    return bytes(out)
+
+def _members(zf):
+    """Return {name: ZipInfo} for the files in an archive."""
+    return {info.filename: info for info in zf.infolist() if not info.is_dir()}
+
+def _raw(fileobj, info):
+    return zip_writer.read_raw(fileobj, info.header_offset, info.compress_size)
+
+def _recompress_level(data, payload, levels):
+    for level in levels:
+        if zip_writer.compress(data, level)[1] == payload:
+            return level
+    return None
+
+def make_delta(base_path, target_path, delta_path, levels=None):
+    """Write the delta that rebuilds target_path from base_path; return its (size, sha256).
+
+    levels maps member names to the deflate level they were built with (the
+    build manifest); LEVELS are tried for the others.
+    """
+    levels = levels or {}
+    entries = []
+    payloads = []
+    with open(base_path, 'rb') as base_file, open(target_path, 'rb') as target_file:
+        base_zip = zipfile.ZipFile(base_file)
+        target_zip = zipfile.ZipFile(target_file)
+        base_members = _members(base_zip)
+        for info in target_zip.infolist():
+            entry = {
+                'name': info.filename,
+                'date_time': list(info.date_time),
+                'external_attr': info.external_attr,
+                'crc': info.CRC,
+                'file_size': info.file_size,
+                'method': info.compress_type
+            }
+            payload = _raw(target_file, info)
+            old = base_members.get(info.filename)
+            old_payload = _raw(base_file, old) if old else b''
+            if old and old.CRC == info.CRC and old_payload == payload:
+                entry['op'] = 'copy'
+            else:
+                entry['payload'] = len(payloads)
+                data = target_zip.read(info) if info.compress_type == zip_writer.ZIP_DEFLATED else None
+                member_levels = ((levels[info.filename],) if info.filename in levels else ()) + LEVELS
+                level = _recompress_level(data, payload, member_levels) if data is not None else None
+                if level is not None:
+                    # Diff the content, which is stable around small edits
+                    entry['op'] = 'content'
+                    entry['level'] = level
+                    old_data = base_zip.read(old) if old else b''
+                    payloads.append(diff_bytes(old_data, data))
+                else:
+                    entry['op'] = 'payload'
+                    payloads.append(diff_bytes(old_payload, payload))
+            entries.append(entry)
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'base': {'sha256': cache.sha256_file(base_path), 'size': os.path.getsize(base_path)},
+        'target': {'sha256': cache.sha256_file(target_path), 'size': os.path.getsize(target_path)},
+        'members': entries
+    }
+    with open(delta_path, 'wb') as raw_out:
+        out = zip_writer.HashingWriter(raw_out)
+        with zip_writer.ZipWriter(out) as writer:
+            writer.write(MANIFEST_NAME, json.dumps(manifest, indent=1).encode(), 9)
+            for i, payload in enumerate(payloads):
+                writer.write(f"members/{i}", payload, 9)
+    return out.size, out.hexdigest()
+
+def apply_delta(base_path, delta_path, out):
+    """Rebuild the target package from base_path and delta_path into the file object out.
+
+    Returns the target's hex SHA-256. Raises DeltaError if the base is not
+    the one the delta was made against or the result does not verify.
+    """
+    with zipfile.ZipFile(delta_path) as delta_zip:
+        manifest = json.loads(delta_zip.read(MANIFEST_NAME))
+        if manifest.get('format') != FORMAT_VERSION:
+            raise DeltaError(f"Unsupported delta format {manifest.get('format')}")
+        if cache.sha256_file(base_path) != manifest['base']['sha256']:
+            raise DeltaError("Base package does not match the delta's base checksum")
+
+        hashing = zip_writer.HashingWriter(out)
+        with open(base_path, 'rb') as base_file:
+            base_zip = zipfile.ZipFile(base_file)
+            base_members = _members(base_zip)
+            writer = zip_writer.ZipWriter(hashing)
+            for entry in manifest['members']:
+                old = base_members.get(entry['name'])
+                if entry['op'] == 'copy':
+                    payload = _raw(base_file, old)
+                elif entry['op'] == 'content':
+                    old_data = base_zip.read(old) if old else b''
+                    data = patch_bytes(old_data, delta_zip.read(f"members/{entry['payload']}"))
+                    crc, payload = zip_writer.compress(data, entry['level'])
+                    if crc != entry['crc']:
+                        raise DeltaError(f"{entry['name']}: CRC mismatch after applying the delta")
+                else:
+                    old_payload = _raw(base_file, old) if old else b''
+                    payload = patch_bytes(old_payload, delta_zip.read(f"members/{entry['payload']}"))
+                writer.write_raw(entry['name'], payload, entry['crc'], entry['file_size'], entry['method'],
+                                 date_time=tuple(entry['date_time']), external_attr=entry['external_attr'])
+            writer.close()
+
+    target = manifest['target']
+    if hashing.size != target['size'] or hashing.hexdigest() != target['sha256']:
+        raise DeltaError(f"Rebuilt package does not verify: {hashing.size} bytes, SHA-256 {hashing.hexdigest()}, "
+                         f"expected {target['size']} bytes, SHA-256 {target['sha256']}")
+    return hashing.hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser(description='Make and apply board package deltas')
+    subparsers = parser.add_subparsers(dest='command')
+    make_parser = subparsers.add_parser('make', help='Make a delta from a base package to a new package')
+    make_parser.add_argument('base')
+    make_parser.add_argument('target')
+    make_parser.add_argument('delta')
+    apply_parser = subparsers.add_parser('apply', help='Rebuild a package from its base and a delta and verify it')
+    apply_parser.add_argument('base')
+    apply_parser.add_argument('delta')
+    apply_parser.add_argument('output', nargs='?', help='Where to write the package (default: only verify)')
+    args = parser.parse_args()
+
+    if args.command == 'make':
+        size, sha256 = make_delta(args.base, args.target, args.delta)
+        print(f"Delta created: {args.delta}")
+        print(f"Delta size: {size} (target {os.path.getsize(args.target)})")
+        print(f"SHA-256: {sha256}")
+    elif args.command == 'apply':
+        try:
+            if args.output:
+                with open(args.output, 'wb') as f:
+                    sha256 = apply_delta(args.base, args.delta, f)
+            else:
+                sha256 = apply_delta(args.base, args.delta, io.BytesIO())
+        except (DeltaError, zipfile.BadZipFile, KeyError) as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+        print(f"Verified: delta + base = target (SHA-256 {sha256})")
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
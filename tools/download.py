@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Streaming, resumable downloads with integrity checks.
+
+Data is hashed while it is written to ``<dest>.part``. An interrupted transfer
+is resumed with an HTTP Range request (on the next attempt or the next run),
+guarded by If-Range so a changed remote file is fetched whole again;
+transient errors are retried with exponential backoff, and the result is
+checked against the expected SHA-256 and size before it is moved into place.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import http.client
+import urllib.error
+import urllib.request
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 1.0
+DEFAULT_TIMEOUT = 30
+USER_AGENT = "esp32-hub-tools"
+
+class DownloadError(Exception):
+    """Raised when a download fails permanently or does not verify."""
+
+class NotModified(DownloadError):
+    """Raised when a conditional request finds the local copy still current."""
+
+def _hash_existing(path, digest):
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE * 16), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return size
+
+def _range_validator(headers):
+    """Return the validator If-Range accepts for a response: a strong ETag or Last-Modified."""
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+def _load_part_validator(path, url):
+    try:
+        with open(path, 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta.get('validator') if meta.get('url') == url else None
+
+def _is_permanent(error, url):
+    if url.startswith('file:'):
+        return True
+    if isinstance(error, urllib.error.HTTPError):
+        # Retry timeouts, rate limiting and server errors only
+        return error.code < 500 and error.code not in (408, 429)
+    return False
+
+class _Progress:
+    def __init__(self, label, enabled):
+        self.label = label
+        self.enabled = enabled and sys.stdout.isatty()
+        self.last = 0
+
+    def update(self, done, total):
+        if not self.enabled or time.monotonic() - self.last < 0.2:
+            return
+        self.last = time.monotonic()
+        if total:
+            print(f"\r  {self.label}: {done * 100 // total}% ({done}/{total} bytes)", end='', flush=True)
+        else:
+            print(f"\r  {self.label}: {done} bytes", end='', flush=True)
+
+    def finish(self, done):
+        if self.enabled:
+            print(f"\r  {self.label}: {done} bytes" + " " * 20)
+
+def download(url, dest, expected_sha256=None, expected_size=None, retries=DEFAULT_RETRIES,
+             backoff=DEFAULT_BACKOFF, timeout=DEFAULT_TIMEOUT, progress=True,
+             headers=None, validators=None):
+    """Download url to dest and return its hex SHA-256.
+
+    A leftover ``dest + '.part'`` from an earlier attempt is resumed rather
+    than fetched again, as long as the remote file still has the validator
+    recorded for it or expected_sha256 will catch a mismatch. Raises DownloadError on failure or checksum mismatch,
+    and NotModified when the server answers extra request headers with 304.
+    If validators is a dict it receives the response's ETag and Last-Modified.
+    """
+    part_path = dest + ".part"
+    part_meta_path = part_path + ".json"
+    part_validator = _load_part_validator(part_meta_path, url) if os.path.exists(part_path) else None
+    if os.path.exists(part_path) and not part_validator and not expected_sha256:
+        # Nothing would tell an old partial file from a changed remote one
+        os.remove(part_path)
+    digest = hashlib.sha256()
+    offset = _hash_existing(part_path, digest) if os.path.exists(part_path) else 0
+    if offset:
+        print(f"  Resuming {os.path.basename(dest)} at {offset} bytes")
+    meter = _Progress(os.path.basename(dest), progress)
+
+    attempt = 0
+    while True:
+        try:
+            request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT, **(headers or {})})
+            if offset:
+                request.add_header('Range', f'bytes={offset}-')
+                if part_validator:
+                    request.add_header('If-Range', part_validator)
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                if offset and getattr(response, 'status', None) != 206:
+                    # Server ignored the range request or the file changed, start over
+                    offset = 0
+                    digest = hashlib.sha256()
+                if not offset:
+                    part_validator = _range_validator(response.headers)
+                    with open(part_meta_path, 'w') as f:
+                        json.dump({'url': url, 'validator': part_validator}, f)
+                if validators is not None:
+                    validators['etag'] = response.headers.get('ETag')
+                    validators['last_modified'] = response.headers.get('Last-Modified')
+                length = response.headers.get('Content-Length')
+                total = offset + int(length) if length else expected_size
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        offset += len(chunk)
+                        meter.update(offset, total)
+                if length and offset < total:
+                    raise http.client.IncompleteRead(b'', total - offset)
+            break
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                raise NotModified(f"{url}: not modified") from e
+            if e.code == 416 and offset:
+                # Our partial file does not fit the remote one; drop it
+                os.remove(part_path)
+                part_validator = None
+                offset = 0
+                digest = hashlib.sha256()
+                continue
+            if _is_permanent(e, url) or attempt >= retries:
+                raise DownloadError(f"{url}: {e}") from e
+        except (urllib.error.URLError, OSError, http.client.HTTPException) as e:
+            if _is_permanent(e, url) or attempt >= retries:
+                raise DownloadError(f"{url}: {e}") from e
+        attempt += 1
+        delay = backoff * 2 ** (attempt - 1)
+        print(f"  Download interrupted at {offset} bytes, retrying in {delay:.0f}s ({attempt}/{retries})")
+        time.sleep(delay)
+    meter.finish(offset)
+    if os.path.exists(part_meta_path):
+        os.remove(part_meta_path)
+
+    sha256 = digest.hexdigest()
+    if expected_size is not None and offset != int(expected_size):
+        os.remove(part_path)
+        raise DownloadError(f"{url}: expected {expected_size} bytes, got {offset}")
+    if expected_sha256 and sha256 != expected_sha256.lower():
+        os.remove(part_path)
+        raise DownloadError(f"{url}: SHA-256 mismatch, expected {expected_sha256.lower()}, got {sha256}")
+    os.replace(part_path, dest)
+    return sha256
+
+def _load_validators(meta_path, url):
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return meta if meta.get('url') == url else {}
+
+def refresh(url, dest, offline=False, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+            timeout=DEFAULT_TIMEOUT, progress=True):
+    """Keep dest up to date with url using conditional requests.
+
+    The ETag and Last-Modified of the last download are stored next to dest
+    in ``dest + '.meta.json'`` and sent back as If-None-Match and
+    If-Modified-Since, so an unchanged document costs one 304 response. In
+    offline mode, or when the server cannot be reached, the existing copy is
+    used as is. Returns True if dest was (re)downloaded.
+    """
+    meta_path = dest + ".meta.json"
+    have_copy = os.path.exists(dest)
+    if offline:
+        if not have_copy:
+            raise DownloadError(f"{url}: no cached copy at {dest} (offline mode)")
+        print(f"  Using cached {os.path.basename(dest)} (offline mode)")
+        return False
+
+    meta = _load_validators(meta_path, url) if have_copy else {}
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    # A partial body is never resumed here: it may belong to an older document
+    # than the one the validators stored below would describe
+    for path in (dest + ".part", dest + ".part.json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    validators = {}
+    try:
+        download(url, dest, retries=retries, backoff=backoff, timeout=timeout,
+                 progress=progress, headers=headers, validators=validators)
+    except NotModified:
+        print(f"  {os.path.basename(dest)} is up to date")
+        return False
+    except DownloadError as e:
+        if not have_copy:
+            raise
+        print(f"  Warning: {e}; using cached {os.path.basename(dest)}")
+        return False
+
+    validators['url'] = url
+    with open(meta_path, 'w') as f:
+        json.dump(validators, f, indent=2)
+    return True
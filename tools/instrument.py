@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Lightweight timing spans for the build tools.
+
+Wrap a stage in ``with instrument.span("name") as s:`` and record what it
+moved with ``s.add(bytes_read=..., bytes_written=..., files=...)``. Every
+span records wall time and the CPU time of the thread that ran it (work done
+in worker processes shows up as wall time only). Spans nest per thread and
+can be written as a Chrome trace (chrome://tracing, Perfetto) or summarized
+as a table.
+"""
+
+import os
+import json
+import time
+import threading
+import contextlib
+
+COUNTERS = ('bytes_read', 'bytes_written', 'files')
+
+_spans = []
+_lock = threading.Lock()
+_local = threading.local()
+_origin = time.perf_counter()
+
+class Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = dict(args)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.thread = threading.get_ident()
+        self.depth = 0
+        self.start = self.end = time.perf_counter()
+        self.cpu = 0.0
+
+    def add(self, **counts):
+        """Add to this span's counters (bytes_read, bytes_written, files or any other)."""
+        for key, value in counts.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @property
+    def wall(self):
+        return self.end - self.start
+
+@contextlib.contextmanager
+def span(name, **args):
+    """Time the enclosed block as a span called name; args go into the trace."""
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    current = Span(name, args)
+    current.depth = len(stack)
+    stack.append(current)
+    cpu_start = time.thread_time()
+    current.start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.end = time.perf_counter()
+        current.cpu = time.thread_time() - cpu_start
+        stack.pop()
+        with _lock:
+            _spans.append(current)
+
+def current():
+    """Return the innermost open span of this thread, or None."""
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+@contextlib.contextmanager
+def within(parent):
+    """Nest spans opened by this thread under parent, a span from another thread."""
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    if parent is None:
+        yield
+        return
+    # A stand-in at the parent's depth; it is never recorded
+    marker = Span(parent.name, {})
+    marker.depth = parent.depth
+    stack.append(marker)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+def add(**counts):
+    """Add counters to the innermost open span of this thread, if any."""
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1].add(**counts)
+
+def spans():
+    """Return the finished spans in start order."""
+    with _lock:
+        return sorted(_spans, key=lambda s: s.start)
+
+def reset():
+    with _lock:
+        _spans.clear()
+
+def chrome_trace():
+    """Return the finished spans as a Chrome trace event document."""
+    threads = {}
+    events = []
+    for s in spans():
+        tid = threads.setdefault(s.thread, len(threads) + 1)
+        events.append({
+            'name': s.name,
+            'cat': 'build',
+            'ph': 'X',
+            'ts': round((s.start - _origin) * 1e6, 3),
+            'dur': round(s.wall * 1e6, 3),
+            'pid': os.getpid(),
+            'tid': tid,
+            'args': dict(s.args, cpu_ms=round(s.cpu * 1000, 3),
+                         **{key: value for key, value in s.counters.items() if value})
+        })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_chrome_trace(path):
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(), f, indent=1)
+
+def _format_bytes(count):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if count < 1024 or unit == 'GB':
+            return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1024
+
+def summary():
+    """Return a table of spans by name: calls, wall and CPU time, bytes and files."""
+    rows = {}
+    for s in spans():
+        label = '  ' * s.depth + s.name
+        row = rows.setdefault(label, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, **dict.fromkeys(COUNTERS, 0)})
+        row['calls'] += 1
+        row['wall'] += s.wall
+        row['cpu'] += s.cpu
+        for key in COUNTERS:
+            row[key] += s.counters.get(key, 0)
+
+    width = max([len(label) for label in rows] + [5])
+    lines = [f"{'Stage':<{width}} {'Calls':>5} {'Wall s':>8} {'CPU s':>8} {'Read':>10} {'Written':>10} {'Files':>6}"]
+    lines.append('-' * len(lines[0]))
+    for label, row in rows.items():
+        lines.append(f"{label:<{width}} {row['calls']:>5} {row['wall']:>8.3f} {row['cpu']:>8.3f} "
+                     f"{_format_bytes(row['bytes_read']):>10} {_format_bytes(row['bytes_written']):>10} "
+                     f"{row['files']:>6}")
+    return '\n'.join(lines)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Shared model of package_esp32hub_index.json.
+
+Every tool loads the index through load() or edit(), changes it through the
+typed accessors below and saves it once. Saving writes a temp file and
+renames it over the index, so a crash never leaves a torn file, and always
+uses the same formatting, so unchanged fields never show up in diffs.
+"""
+
+import os
+import json
+import tempfile
+import contextlib
+
+INDENT = 2
+
+class Platform:
+    """One entry of a package's 'platforms' list."""
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def version(self):
+        return self.data['version']
+
+    @property
+    def size(self):
+        return int(self.data['size']) if 'size' in self.data else None
+
+    @property
+    def checksum(self):
+        """The SHA-256 hex digest, without the 'SHA-256:' prefix."""
+        value = self.data.get('checksum', '')
+        return value.split(':', 1)[1] if value.startswith('SHA-256:') else None
+
+    def set_archive(self, size, checksum):
+        """Record the package archive size and SHA-256 hex digest."""
+        self.data['size'] = str(size)
+        self.data['checksum'] = f"SHA-256:{checksum}"
+
+    @property
+    def delta(self):
+        """The delta package entry ({url, archiveFileName, checksum, size, baseChecksum}), if any."""
+        return self.data.get('delta')
+
+    def set_delta(self, file_name, size, checksum, base_checksum):
+        """Record a delta package next to this platform's archive, published beside it."""
+        self.data['delta'] = {
+            'url': self.data['url'].rsplit('/', 1)[0] + '/' + file_name,
+            'archiveFileName': file_name,
+            'checksum': f"SHA-256:{checksum}",
+            'size': str(size),
+            'baseChecksum': f"SHA-256:{base_checksum}"
+        }
+
+    def clear_delta(self):
+        self.data.pop('delta', None)
+
+    @property
+    def boards(self):
+        return [board['name'] for board in self.data.get('boards', [])]
+
+    @boards.setter
+    def boards(self, names):
+        self.data['boards'] = [{'name': name} for name in names]
+
+    @property
+    def tools_dependencies(self):
+        return self.data.get('toolsDependencies', [])
+
+    @tools_dependencies.setter
+    def tools_dependencies(self, dependencies):
+        self.data['toolsDependencies'] = list(dependencies)
+
+class PackageIndex:
+    def __init__(self, path, data, text=None):
+        self.path = path
+        self.data = data
+        self._saved_text = text
+
+    @property
+    def package(self):
+        return self.data['packages'][0]
+
+    @property
+    def platforms(self):
+        return [Platform(data) for data in self.package.get('platforms', [])]
+
+    def platform(self, version=None):
+        """Return the platform for version, or the first platform if version is None."""
+        for platform in self.platforms:
+            if version is None or platform.version == version:
+                return platform
+        raise KeyError(f"No platform with version {version} in {self.path}")
+
+    def add_platform(self, version):
+        """Return the platform for version, adding one modelled on the first platform if missing."""
+        try:
+            return self.platform(version)
+        except KeyError:
+            pass
+        template = self.platform()
+        data = json.loads(json.dumps(template.data))
+        for field in ('url', 'archiveFileName'):
+            if field in data:
+                data[field] = data[field].replace(template.version, version)
+        data['version'] = version
+        data.pop('checksum', None)
+        data.pop('size', None)
+        data.pop('delta', None)
+        self.package['platforms'].append(data)
+        return Platform(data)
+
+    @property
+    def tools(self):
+        return self.package.get('tools', [])
+
+    @tools.setter
+    def tools(self, definitions):
+        self.package['tools'] = list(definitions)
+
+    def dumps(self):
+        return json.dumps(self.data, indent=INDENT)
+
+    @property
+    def changed(self):
+        return self.dumps() != self._saved_text
+
+    def save(self):
+        """Atomically write the index if it changed; return True if it was written."""
+        text = self.dumps()
+        if text == self._saved_text:
+            return False
+        write_atomic(self.path, text)
+        self._saved_text = text
+        return True
+
+def write_atomic(path, text):
+    """Replace path with text via a temp file in the same directory."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def load(path):
+    """Load the package index at path."""
+    with open(path, 'r') as f:
+        text = f.read()
+    return PackageIndex(path, json.loads(text), text)
+
+@contextlib.contextmanager
+def edit(path):
+    """Load the index, yield it for changes and save it once on success."""
+    index = load(path)
+    yield index
+    index.save()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Pure-Python unified diff parser, applier and generator.
+
+Patches are parsed into FilePatch/Hunk objects and applied to in-memory
+buffers. Like GNU patch, each hunk is searched for outward from its recorded
+line number (offset) and, failing that, with up to ``max_fuzz`` context lines
+ignored at either end (fuzz); a hunk without leading context only matches at
+line 1 and one without trailing context only at the end of the file. Unlike
+GNU patch, reversed or already applied patches are not detected: their hunks
+simply fail. Every hunk reports how it was applied.
+"""
+
+import re
+import difflib
+from dataclasses import dataclass, field
+
+DEFAULT_FUZZ = 2
+
+_HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$')
+_LINE_RE = re.compile(r'[^\n]*\n|[^\n]+$')
+
+class PatchError(Exception):
+    """Raised when a patch cannot be parsed."""
+
+@dataclass
+class Hunk:
+    old_start: int
+    old_len: int
+    new_start: int
+    new_len: int
+    # (tag, text) pairs; tag is ' ', '-' or '+' and text keeps its line ending
+    lines: list = field(default_factory=list)
+    section: str = ''
+
+    def old_lines(self):
+        return [text for tag, text in self.lines if tag != '+']
+
+    def new_lines(self):
+        return [text for tag, text in self.lines if tag != '-']
+
+@dataclass
+class FilePatch:
+    old_path: str
+    new_path: str
+    hunks: list = field(default_factory=list)
+
+    def target(self, strip=1):
+        """Return the patched path with `strip` leading components removed (like -p)."""
+        path = self.old_path if self.new_path == '/dev/null' else self.new_path
+        parts = path.split('/')
+        return '/'.join(parts[strip:]) if len(parts) > strip else parts[-1]
+
+    @property
+    def is_new(self):
+        return self.old_path == '/dev/null'
+
+    @property
+    def is_deleted(self):
+        return self.new_path == '/dev/null'
+
+@dataclass
+class HunkResult:
+    index: int
+    status: str     # 'applied', 'offset', 'fuzz' or 'failed'
+    line: int = 0   # 1-based line in the original file where the hunk matched
+    offset: int = 0
+    fuzz: int = 0
+
+    def describe(self):
+        if self.status == 'failed':
+            return f"hunk #{self.index} FAILED at {self.line}"
+        text = f"hunk #{self.index} succeeded at {self.line}"
+        if self.offset:
+            text += f" (offset {self.offset} line{'s' if abs(self.offset) != 1 else ''})"
+        if self.fuzz:
+            text += f" with fuzz {self.fuzz}"
+        return text
+
+@dataclass
+class PatchResult:
+    path: str
+    hunks: list
+    data: bytes = None  # patched content, None if any hunk failed or the file was deleted
+
+    @property
+    def ok(self):
+        return all(h.status != 'failed' for h in self.hunks)
+
+def split_lines(text):
+    """Split text after each '\\n' only (str.splitlines also breaks on \\f, \\r, ...)."""
+    return _LINE_RE.findall(text)
+
+def _patch_path(line):
+    return line[4:].split('\t')[0].rstrip('\r\n').strip()
+
+def _drop_newline(hunk):
+    tag, text = hunk.lines[-1]
+    if text.endswith('\n'):
+        hunk.lines[-1] = (tag, text[:-1])
+
+def parse_patch(text):
+    """Parse unified diff text into a list of FilePatch objects.
+
+    Lines before the first ``---``/``+++`` pair (e.g. our ``#`` headers) are
+    ignored; a patch without any file sections parses to an empty list.
+    """
+    lines = split_lines(text)
+    patches = []
+    current = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith('--- ') and i + 1 < len(lines) and lines[i + 1].startswith('+++ '):
+            current = FilePatch(_patch_path(line), _patch_path(lines[i + 1]))
+            patches.append(current)
+            i += 2
+            continue
+
+        match = _HUNK_RE.match(line.rstrip('\r\n'))
+        if not match:
+            i += 1
+            continue
+        if current is None:
+            raise PatchError(f"Hunk without file header at line {i + 1}")
+
+        old_len = int(match.group(2)) if match.group(2) is not None else 1
+        new_len = int(match.group(4)) if match.group(4) is not None else 1
+        hunk = Hunk(int(match.group(1)), old_len, int(match.group(3)), new_len,
+                    section=match.group(5).strip())
+        old_seen = new_seen = 0
+        i += 1
+        while i < len(lines) and (old_seen < old_len or new_seen < new_len):
+            line = lines[i]
+            if line.startswith('\\'):
+                _drop_newline(hunk)
+            elif line.startswith(' ') or line in ('\n', '\r\n'):
+                # Some editors strip the space from empty context lines
+                hunk.lines.append((' ', line[1:] if line.startswith(' ') else line))
+                old_seen += 1
+                new_seen += 1
+            elif line.startswith('-'):
+                hunk.lines.append(('-', line[1:]))
+                old_seen += 1
+            elif line.startswith('+'):
+                hunk.lines.append(('+', line[1:]))
+                new_seen += 1
+            else:
+                raise PatchError(f"Malformed hunk line {i + 1}: {line.rstrip()!r}")
+            i += 1
+        if old_seen != old_len or new_seen != new_len:
+            raise PatchError(f"Truncated hunk @@ -{hunk.old_start},{old_len} +{hunk.new_start},{new_len} @@")
+        if i < len(lines) and lines[i].startswith('\\'):
+            _drop_newline(hunk)
+            i += 1
+        current.hunks.append(hunk)
+    return patches
+
+def read_patch(path):
+    """Parse a patch file."""
+    with open(path, 'r', encoding='utf-8', errors='surrogateescape', newline='') as f:
+        return parse_patch(f.read())
+
+def _key(line):
+    return line.rstrip('\r\n')
+
+def _find(keys, pattern, expected, low):
+    """Return the match position nearest to expected at or after low, or None."""
+    size = len(pattern)
+    high = len(keys) - size
+    if high < low:
+        return None
+    expected = min(max(expected, low), high)
+    for delta in range(max(expected - low, high - expected) + 1):
+        for pos in (expected + delta, expected - delta) if delta else (expected,):
+            if low <= pos <= high and keys[pos:pos + size] == pattern:
+                return pos
+    return None
+
+def _context_sizes(hunk):
+    """Return the number of leading and trailing context lines of a hunk."""
+    lines = hunk.lines
+    prefix = 0
+    while prefix < len(lines) and lines[prefix][0] == ' ':
+        prefix += 1
+    suffix = 0
+    while suffix < len(lines) - prefix and lines[len(lines) - 1 - suffix][0] == ' ':
+        suffix += 1
+    return prefix, suffix
+
+def _locate(keys, pattern, expected, low, at_start, at_end):
+    """Find pattern like _find(), or only at the start and/or end of the file when anchored."""
+    if at_start and at_end:
+        return 0 if low == 0 and keys == pattern else None
+    if at_start:
+        return 0 if low == 0 and keys[:len(pattern)] == pattern else None
+    if at_end:
+        pos = len(keys) - len(pattern)
+        return pos if pos >= low and keys[pos:] == pattern else None
+    return _find(keys, pattern, expected, low)
+
+def apply_lines(source_lines, file_patch, max_fuzz=DEFAULT_FUZZ):
+    """Apply a FilePatch to a list of lines and return (new lines, [HunkResult])."""
+    keys = [_key(line) for line in source_lines]
+    output = []
+    results = []
+    cursor = 0
+    last_offset = 0
+
+    for index, hunk in enumerate(file_patch.hunks, 1):
+        # Pure insertions are recorded against the line before them
+        base = hunk.old_start if hunk.old_len == 0 else hunk.old_start - 1
+        prefix, suffix = _context_sizes(hunk)
+        context = max(prefix, suffix)
+        found = None
+        tried = set()
+        # GNU patch never ignores more lines than the hunk has context
+        for fuzz in range(min(max_fuzz, context) + 1):
+            # As in GNU patch, the side with less context is trimmed less. Less
+            # leading context than trailing means the hunk starts the file (if
+            # it says so) and less trailing context means it ends the file.
+            prefix_fuzz = fuzz + prefix - context
+            suffix_fuzz = fuzz + suffix - context
+            at_start = prefix_fuzz < 0 and hunk.old_start <= 1
+            at_end = suffix_fuzz < 0
+            lead, trail = max(prefix_fuzz, 0), max(suffix_fuzz, 0)
+            if (lead, trail, at_start, at_end) in tried:
+                continue
+            tried.add((lead, trail, at_start, at_end))
+            lines = hunk.lines[lead:len(hunk.lines) - trail]
+            pattern = [_key(text) for tag, text in lines if tag != '+']
+            # Ignored leading context must still fall after what is already output
+            pos = _locate(keys, pattern, base + lead + last_offset, cursor + lead, at_start, at_end)
+            if pos is not None:
+                found = (pos, lines, fuzz, lead)
+                break
+
+        if found is None:
+            results.append(HunkResult(index, 'failed', base + last_offset + 1))
+            continue
+
+        pos, lines, fuzz, lead = found
+        offset = pos - lead - base
+        last_offset = offset
+        status = 'fuzz' if fuzz else ('offset' if offset else 'applied')
+        results.append(HunkResult(index, status, pos - lead + 1, offset, fuzz))
+
+        output.extend(source_lines[cursor:pos])
+        cursor = pos
+        for tag, text in lines:
+            if tag == ' ':
+                # Keep the original line (and its line ending) for context
+                output.append(source_lines[cursor])
+                cursor += 1
+            elif tag == '-':
+                cursor += 1
+            else:
+                output.append(text)
+
+    output.extend(source_lines[cursor:])
+    return output, results
+
+def apply_patch(data, file_patch, max_fuzz=DEFAULT_FUZZ):
+    """Apply a FilePatch to bytes (None for a new file) and return a PatchResult."""
+    text = '' if data is None else data.decode('utf-8', 'surrogateescape')
+    new_lines, results = apply_lines(split_lines(text), file_patch, max_fuzz)
+    result = PatchResult(file_patch.target(), results)
+    if result.ok and not file_patch.is_deleted:
+        result.data = ''.join(new_lines).encode('utf-8', 'surrogateescape')
+    return result
+
+def make_patch(old, new, old_name, new_name, old_date='', new_date='', context=3):
+    """Return unified diff text turning old bytes into new bytes ('' if equal).
+
+    Output matches ``diff -u``, including "No newline at end of file" markers.
+    """
+    old_lines = split_lines(old.decode('utf-8', 'surrogateescape'))
+    new_lines = split_lines(new.decode('utf-8', 'surrogateescape'))
+    output = []
+    for line in difflib.unified_diff(old_lines, new_lines, old_name, new_name,
+                                     old_date, new_date, n=context):
+        if line.endswith('\n'):
+            output.append(line)
+        else:
+            output.append(line + '\n\\ No newline at end of file\n')
+    return ''.join(output)
@@ -3,36 +3,95 @@
 import os
 import sys
 import json
-import requests
-from urllib.parse import urlparse
+import argparse
+import concurrent.futures
+
+import cache
+import download
+import fileops
+import package_index
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 ESP32_PACKAGE_URL = "https://raw.githubusercontent.com/espressif/arduino-esp32/gh-pages/package_esp32_index.json"
 PACKAGE_INDEX = "../package_esp32hub_index.json"
 CORE_VERSION = "3.0.7"
+CACHE_DIR = cache.DEFAULT_CACHE_DIR
+
+class ToolIndex:
+    """Upstream platforms keyed by version and tools keyed by (name, version)."""
+    
+    def __init__(self, platforms, tools):
+        self.platforms = platforms
+        self.tools = tools
 
-def fetch_esp32_package_index():
-    """Download and parse the official ESP32 package index."""
+def fetch_esp32_package_index(offline=False):
+    """Fetch the official ESP32 package index into the cache and return its local path.
+    
+    The cached copy is revalidated with a conditional request, and used as
+    is when offline or when the server cannot be reached.
+    """
     print(f"Fetching ESP32 package index from {ESP32_PACKAGE_URL}...")
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    index_path = os.path.join(CACHE_DIR, "package_esp32_index.json")
     try:
-        response = requests.get(ESP32_PACKAGE_URL)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        download.refresh(ESP32_PACKAGE_URL, index_path, offline)
+    except download.DownloadError as e:
         print(f"Error fetching ESP32 package index: {e}")
         sys.exit(1)
+    return index_path
+
+def _tool_key(tool):
+    return (tool['name'], tool['version'])
+
+def load_tool_index(index_path, versions=None):
+    """Parse an upstream package index into a ToolIndex.
+    
+    With versions, only those platforms and the tools they depend on are
+    kept. When ijson is installed the document is streamed instead of being
+    loaded whole.
+    """
+    wanted = set(versions) if versions else None
+    try:
+        if ijson is not None:
+            with open(index_path, 'rb') as f:
+                platforms = {p['version']: p
+                             for p in ijson.items(f, 'packages.item.platforms.item', use_float=True)
+                             if wanted is None or p['version'] in wanted}
+        else:
+            with open(index_path, 'r') as f:
+                package = json.load(f)['packages'][0]
+            platforms = {p['version']: p for p in package['platforms']
+                         if wanted is None or p['version'] in wanted}
+        
+        needed = None
+        if wanted is not None:
+            needed = {_tool_key(dep) for p in platforms.values() for dep in p.get('toolsDependencies', [])}
+        
+        if ijson is not None:
+            with open(index_path, 'rb') as f:
+                tools = {_tool_key(t): t
+                         for t in ijson.items(f, 'packages.item.tools.item', use_float=True)
+                         if needed is None or _tool_key(t) in needed}
+        else:
+            tools = {_tool_key(t): t for t in package.get('tools', [])
+                     if needed is None or _tool_key(t) in needed}
+    except (ValueError, KeyError) as e:
+        print(f"Error parsing ESP32 package index: {e}")
+        sys.exit(1)
+    return ToolIndex(platforms, tools)
 
-def find_tools_for_version(package_data, version=CORE_VERSION):
+def find_tools_for_version(tool_index, version=CORE_VERSION):
     """Extract complete tool definitions for specific version."""
     print(f"\nFinding tools for version {version}...")
     tools_found = set()
     tools_definitions = []
     
     # Find the platform with matching version
-    platform = next(
-        (p for p in package_data['packages'][0]['platforms'] 
-         if p['version'] == version),
-        None
-    )
+    platform = tool_index.platforms.get(version)
     
     if not platform:
         print(f"Error: Could not find platform version {version}")
@@ -54,12 +113,7 @@ def find_tools_for_version(package_data, version=CORE_VERSION):
             
             # Only include tool definition if it's not from Arduino
             if tool_dep['packager'] != 'arduino':
-                tool_def = next(
-                    (tool for tool in package_data['packages'][0].get('tools', [])
-                     if tool['name'] == tool_dep['name'] and 
-                        tool['version'] == tool_dep['version']),
-                    None
-                )
+                tool_def = tool_index.tools.get(_tool_key(tool_dep))
                 
                 if tool_def:
                     tools_definitions.append(tool_def)
@@ -69,33 +123,131 @@ def find_tools_for_version(package_data, version=CORE_VERSION):
             
     return tools_dependencies, tools_definitions
 
-def update_package_index(tools_dependencies, tools_definitions):
-    """Update tools in the package index."""
+def core_archive_digest(tool_index, version=CORE_VERSION):
+    """Return the (SHA-256 hex, size) upstream publishes for the core archive of version.
+    
+    Either is None when the platform or the field is missing.
+    """
+    platform = tool_index.platforms.get(version) or {}
+    checksum = platform.get('checksum', '')
+    sha256 = checksum.split(':', 1)[1].lower() if checksum.startswith('SHA-256:') else None
+    size = int(platform['size']) if platform.get('size') else None
+    return sha256, size
+
+def find_tools_for_versions(tool_index, versions):
+    """Return {version: (tools_dependencies, tools_definitions)} for several core versions."""
+    return {version: find_tools_for_version(tool_index, version) for version in versions}
+
+def update_package_index(tools_dependencies, tools_definitions, index=None, version=None):
+    """Update tools in the package index.
+    
+    index is a package_index.PackageIndex to edit in place (the caller
+    saves it); without one, PACKAGE_INDEX is loaded and saved here. The
+    dependencies go to the platform for version, or the first platform.
+    """
+    if index is None:
+        if not os.path.exists(PACKAGE_INDEX):
+            print(f"Error: Package index {PACKAGE_INDEX} not found")
+            sys.exit(1)
+        with package_index.edit(PACKAGE_INDEX) as index:
+            update_package_index(tools_dependencies, tools_definitions, index, version)
+        return
+    
     print("\nUpdating package index...")
     
-    if os.path.exists(PACKAGE_INDEX):
-        with open(PACKAGE_INDEX, 'r') as f:
-            package_data = json.load(f)
-            
-        # Update toolsDependencies
-        if 'platforms' in package_data['packages'][0] and package_data['packages'][0]['platforms']:
-            package_data['packages'][0]['platforms'][0]['toolsDependencies'] = tools_dependencies
-            
-        # Update or add tools definitions
-        if tools_definitions:
-            package_data['packages'][0]['tools'] = tools_definitions
-            
-        with open(PACKAGE_INDEX, 'w') as f:
-            json.dump(package_data, f, indent=4)
+    # Update toolsDependencies
+    if index.platforms:
+        index.platform(version).tools_dependencies = tools_dependencies
         
-        print(f"Updated {PACKAGE_INDEX} with:")
-        print(f"- {len(tools_dependencies)} tool dependencies")
-        print(f"- {len(tools_definitions)} complete tool definitions")
-    else:
-        print(f"Error: Package index {PACKAGE_INDEX} not found")
-        sys.exit(1)
+    # Update or add tools definitions
+    if tools_definitions:
+        index.tools = tools_definitions
+    
+    print(f"Updated {index.path} with:")
+    print(f"- {len(tools_dependencies)} tool dependencies")
+    print(f"- {len(tools_definitions)} complete tool definitions")
+
+def _archive_key(tool, system):
+    return f"{tool['name']}-{tool['version']}/{system['archiveFileName']}"
+
+def _mirror_archive(mirror_dir, key, system):
+    """Fetch one archive into the mirror; return 'cached' or 'downloaded'."""
+    sha256 = system['checksum'].split(':', 1)[1].lower()
+    path = cache.lookup(mirror_dir, key, sha256)
+    status = 'cached'
+    if path is None:
+        temp_path = os.path.join(mirror_dir, f".download-{sha256}")
+        download.download(system['url'], temp_path, sha256, system.get('size'), progress=False)
+        path = cache.store(mirror_dir, key, temp_path, sha256, max_bytes=float('inf'))
+        status = 'downloaded'
+    
+    # Name-addressed view, so a plain HTTP server can serve the mirror
+    named = os.path.join(mirror_dir, "archives", system['archiveFileName'])
+    if not os.path.exists(named) or not os.path.samefile(named, path):
+        os.makedirs(os.path.dirname(named), exist_ok=True)
+        temp_named = named + ".tmp"
+        fileops.clone_file(path, temp_named, hardlink=True)
+        os.replace(temp_named, named)
+    return status
+
+def mirror_tools(tools_definitions, mirror_dir, hosts=None, jobs=4):
+    """Download the archives of tools_definitions into a content-addressed store.
+    
+    Every systems[*] archive (only those for hosts, if given) is downloaded
+    once per checksum with at most jobs transfers at a time, verified against
+    its SHA-256 and size while streaming, and stored under mirror_dir as
+    objects/<sha[:2]>/<sha256> with a hardlink at archives/<archiveFileName>.
+    Archives already in the store are verified instead of downloaded.
+    Returns the list of archive keys that failed.
+    """
+    archives = {}
+    for tool in tools_definitions:
+        for system in tool.get('systems', []):
+            if hosts and system['host'] not in hosts:
+                continue
+            if not system.get('checksum', '').startswith('SHA-256:'):
+                print(f"  ! {tool['name']} {tool['version']} ({system['host']}): no SHA-256 checksum, skipping")
+                continue
+            # Hosts often share one archive; fetch it once
+            archives.setdefault(system['checksum'].lower(), (_archive_key(tool, system), system))
+    
+    print(f"\nMirroring {len(archives)} archives into {mirror_dir}...")
+    os.makedirs(mirror_dir, exist_ok=True)
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_mirror_archive, mirror_dir, key, system): (key, system)
+                   for key, system in archives.values()}
+        for future in concurrent.futures.as_completed(futures):
+            key, system = futures[future]
+            try:
+                status = future.result()
+                print(f"  + {key} ({system.get('size', '?')} bytes, {status})")
+            except (download.DownloadError, OSError) as e:
+                print(f"  ! {key}: {e}")
+                failed.append(key)
+    
+    print(f"Mirrored {len(archives) - len(failed)} of {len(archives)} archives")
+    return sorted(failed)
 
 def main():
+    parser = argparse.ArgumentParser(description='Update tool dependencies from the ESP32 package index')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('update', help='Copy tool dependencies into the package index (default)')
+    mirror_parser = subparsers.add_parser('mirror', help='Download and verify the archives of the tools in the package index')
+    mirror_parser.add_argument('--dest', help='Mirror directory (default: <cache-dir>/mirror)')
+    mirror_parser.add_argument('--host', action='append', dest='hosts',
+                             help='Only mirror archives for this host triplet (repeatable)')
+    mirror_parser.add_argument('--jobs', '-j', type=int, default=4,
+                             help='Concurrent downloads (default: %(default)s)')
+    parser.add_argument('--offline', action='store_true',
+                      help='Use the cached ESP32 package index without contacting the server')
+    parser.add_argument('--cache-dir', default=cache.DEFAULT_CACHE_DIR,
+                      help='Download cache directory (default: %(default)s)')
+    args = parser.parse_args()
+    
+    global CACHE_DIR
+    CACHE_DIR = args.cache_dir
+    
     # Get script's directory and move up one level
     script_dir = os.path.dirname(os.path.abspath(__file__))
     repo_root = os.path.dirname(script_dir)
@@ -104,9 +256,16 @@ def main():
     global PACKAGE_INDEX
     PACKAGE_INDEX = os.path.join(repo_root, "package_esp32hub_index.json")
     
+    if args.command == "mirror":
+        index = package_index.load(PACKAGE_INDEX)
+        failed = mirror_tools(index.tools, args.dest or os.path.join(CACHE_DIR, "mirror"), args.hosts, args.jobs)
+        if failed:
+            sys.exit(1)
+        return
+    
     # Fetch and process
-    esp32_package = fetch_esp32_package_index()
-    tools_dependencies, tools_definitions = find_tools_for_version(esp32_package)
+    tool_index = load_tool_index(fetch_esp32_package_index(args.offline), [CORE_VERSION])
+    tools_dependencies, tools_definitions = find_tools_for_version(tool_index)
     update_package_index(tools_dependencies, tools_definitions)
     print("\nSuccess! Package index updated with tool dependencies.")
 
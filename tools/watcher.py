@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""File change notification: inotify on Linux, polling elsewhere.
+
+A watcher covers directory trees (recursively) and single files. Single
+files are watched through their parent directory, so editors that save by
+writing a temp file and renaming it over the original are still seen.
+wait_for_changes() blocks until something changes and then debounces, so a
+burst of saves comes back as one set of paths.
+"""
+
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+
+DEFAULT_INTERVAL = 0.5
+DEFAULT_DEBOUNCE = 0.3
+
+# sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+_EVENT = struct.Struct('iIII')
+
+class PollingWatcher:
+    """Detect changes by comparing file mtimes and sizes every interval seconds."""
+
+    def __init__(self, roots, files=(), interval=DEFAULT_INTERVAL):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.files = [os.path.abspath(path) for path in files]
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        state = {}
+        paths = list(self.files)
+        for root in self.roots:
+            for dirpath, _, names in os.walk(root):
+                paths.extend(os.path.join(dirpath, name) for name in names)
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            state[path] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def read(self, timeout=None):
+        """Return the set of paths changed since the last call; empty after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._scan()
+            changed = {path for path in set(current) | set(self.snapshot)
+                       if current.get(path) != self.snapshot.get(path)}
+            self.snapshot = current
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            delay = self.interval if deadline is None else min(self.interval, max(0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """Detect changes with Linux inotify; new subdirectories are watched as they appear."""
+
+    def __init__(self, roots, files=()):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        # Parent directory -> names of single files watched in it
+        self.files = {}
+        for path in files:
+            path = os.path.abspath(path)
+            parent, name = os.path.split(path)
+            self.files.setdefault(parent, set()).add(name)
+            self._watch(parent)
+        self.recursive = set()
+        for root in roots:
+            root = os.path.abspath(root)
+            self.recursive.add(root)
+            if os.path.isdir(root):
+                self._watch_tree(root)
+            else:
+                # Watch for the root being created
+                self.files.setdefault(os.path.dirname(root), set()).add(os.path.basename(root))
+                self._watch(os.path.dirname(root))
+
+    def _watch(self, directory):
+        if directory in self.dirs.values():
+            return
+        wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+        self.dirs[wd] = directory
+
+    def _watch_tree(self, root):
+        for dirpath, _, _ in os.walk(root):
+            self._watch(dirpath)
+
+    def _in_tree(self, path):
+        return any(path == root or path.startswith(root + os.sep) for root in self.recursive)
+
+    def read(self, timeout=None):
+        """Return the set of paths changed since the last call; empty after timeout seconds."""
+        changed = set()
+        while not changed:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return changed
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, pos)
+                name = data[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b'\0')
+                pos += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost; report every watched root and file
+                    changed.update(self.recursive)
+                    changed.update(os.path.join(parent, name) for parent, names in self.files.items()
+                                   for name in names)
+                    continue
+                directory = self.dirs.get(wd)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.dirs[wd]
+                    continue
+                path = os.path.join(directory, os.fsdecode(name)) if name else directory
+                if not self._in_tree(path) and os.path.basename(path) not in self.files.get(directory, ()):
+                    continue
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and self._in_tree(path):
+                    self._watch_tree(path)
+                    # Files may have landed before the watch existed
+                    for dirpath, _, names in os.walk(path):
+                        changed.update(os.path.join(dirpath, n) for n in names)
+                elif path in self.recursive and os.path.isdir(path):
+                    self._watch_tree(path)
+                if not mask & IN_ISDIR:
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def open_watcher(roots, files=(), interval=DEFAULT_INTERVAL, polling=False):
+    """Return an InotifyWatcher, or a PollingWatcher if inotify is unavailable or polling is set."""
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(roots, files)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable ({e}), polling every {interval}s")
+    return PollingWatcher(roots, files, interval)
+
+def wait_for_changes(watcher, debounce=DEFAULT_DEBOUNCE):
+    """Block until files change, then keep collecting until debounce seconds pass quietly."""
+    changed = watcher.read()
+    while True:
+        more = watcher.read(debounce)
+        if not more:
+            return changed
+        changed |= more
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Sequential ZIP writer that accepts pre-compressed members.
+
+zipfile always compresses what it writes, so it cannot reuse a deflate
+stream from another archive. ZipWriter writes local headers and payloads as
+they come and the central directory on close, which lets a build copy
+compressed members byte-for-byte or compress them elsewhere. It never seeks,
+so the target can be any writable file object.
+"""
+
+import struct
+import zlib
+import hashlib
+import zipfile
+
+ZIP_STORED = zipfile.ZIP_STORED
+ZIP_DEFLATED = zipfile.ZIP_DEFLATED
+DEFAULT_LEVEL = 6
+DEFAULT_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_LOCAL_SIGNATURE = 0x04034b50
+_CENTRAL_SIGNATURE = 0x02014b50
+_END_SIGNATURE = 0x06054b50
+_UTF8_FLAG = 0x800
+_VERSION = 20
+_UNIX = 3
+_LIMIT = 0xFFFFFFFF
+
+def compress(data, level=DEFAULT_LEVEL):
+    """Return (crc, raw deflate payload) for data."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return zlib.crc32(data), compressor.compress(data) + compressor.flush()
+
+def _dos_date_time(date_time):
+    if date_time[0] < 1980:
+        date_time = DEFAULT_DATE_TIME
+    year, month, day, hour, minute, second = date_time
+    return ((year - 1980) << 9 | month << 5 | day,
+            hour << 11 | minute << 5 | second // 2)
+
+class HashingWriter:
+    """File object wrapper that hashes and counts bytes as they are written."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+class ZipWriter:
+    def __init__(self, fileobj):
+        self.fp = fileobj
+        self.offset = 0
+        self.entries = []
+
+    def write_raw(self, name, payload, crc, file_size, method=ZIP_DEFLATED,
+                  date_time=DEFAULT_DATE_TIME, external_attr=0o100644 << 16):
+        """Write a member whose payload is already compressed with method.
+
+        Returns the entry dict (including its local header offset).
+        """
+        if self.offset + len(payload) > _LIMIT or file_size > _LIMIT or len(self.entries) >= 0xFFFF:
+            raise ValueError("ZIP64 archives are not supported")
+        encoded = name.encode('ascii', 'ignore')
+        flags = 0
+        if encoded.decode('ascii') != name:
+            encoded = name.encode('utf-8')
+            flags |= _UTF8_FLAG
+        date, time = _dos_date_time(date_time)
+        header = _LOCAL_HEADER.pack(_LOCAL_SIGNATURE, _VERSION, flags, method, time, date,
+                                    crc, len(payload), file_size, len(encoded), 0)
+        entry = {
+            'name': name,
+            'encoded': encoded,
+            'flags': flags,
+            'method': method,
+            'date': date,
+            'time': time,
+            'crc': crc,
+            'compress_size': len(payload),
+            'file_size': file_size,
+            'external_attr': external_attr,
+            'offset': self.offset
+        }
+        self.fp.write(header)
+        self.fp.write(encoded)
+        self.fp.write(payload)
+        self.offset += len(header) + len(encoded) + len(payload)
+        self.entries.append(entry)
+        return entry
+
+    def write(self, name, data, level=DEFAULT_LEVEL, **kwargs):
+        """Compress data with deflate and write it as a member."""
+        crc, payload = compress(data, level)
+        return self.write_raw(name, payload, crc, len(data), ZIP_DEFLATED, **kwargs)
+
+    def close(self):
+        """Write the central directory and end record."""
+        start = self.offset
+        for entry in self.entries:
+            header = _CENTRAL_HEADER.pack(
+                _CENTRAL_SIGNATURE, _UNIX << 8 | _VERSION, _VERSION, entry['flags'],
+                entry['method'], entry['time'], entry['date'], entry['crc'],
+                entry['compress_size'], entry['file_size'], len(entry['encoded']),
+                0, 0, 0, 0, entry['external_attr'], entry['offset'])
+            self.fp.write(header)
+            self.fp.write(entry['encoded'])
+            self.offset += len(header) + len(entry['encoded'])
+        end = _END_RECORD.pack(_END_SIGNATURE, 0, 0, len(self.entries), len(self.entries),
+                               self.offset - start, start, 0)
+        self.fp.write(end)
+        self.offset += len(end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+def read_raw(fileobj, header_offset, compress_size):
+    """Return the compressed payload of the member whose local header is at header_offset."""
+    fileobj.seek(header_offset)
+    header = _LOCAL_HEADER.unpack(fileobj.read(_LOCAL_HEADER.size))
+    if header[0] != _LOCAL_SIGNATURE:
+        raise zipfile.BadZipFile(f"No local header at offset {header_offset}")
+    fileobj.seek(header[9] + header[10], 1)
+    return fileobj.read(compress_size)